@@ -1,19 +1,27 @@
 # -*- coding: utf-8 -*-
 
 import re
+import copy
+import json
 import math
+import time
+import atexit
 import datetime
+import threading
 import numpy as np
 import pandas as pd
 from types import NoneType
 from itertools import islice, count
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # blackfynn
 from blackfynn.api.base import APIBase
+from blackfynn.base import PROTOBUF_CONTENT_TYPE, ProtobufContent
 from blackfynn.streaming import TimeSeriesStream
 from blackfynn.utils import (
-    usecs_to_datetime, usecs_since_epoch, infer_epoch, log
+    usecs_since_epoch, infer_epoch, log
 )
 from blackfynn.models import (
     File, TimeSeries,TimeSeriesChannel, TimeSeriesAnnotation, 
@@ -21,9 +29,12 @@ from blackfynn.models import (
 )
 from blackfynn import settings
 from blackfynn.cache import get_cache
+from blackfynn.cache.cache import (
+    read_segment_arrays, adaptive_page_size, SAMPLE_BYTES, PAGE_MISSING, PAGE_EMPTY, PAGE_PRESENT
+)
 
 cache = None
-page_size = settings.ts_page_size
+_cache_lock = threading.Lock()
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Helpers
@@ -32,12 +43,12 @@ page_size = settings.ts_page_size
 def parse_timedelta(time):
     """
     Returns microseconds of time expression, where time can be of the forms:
-     - string:  e.g. '1s', '5m', '3h'
+     - string:  e.g. '1s', '5m', '3h' (or '3hr')
      - delta:   datetime.timedelta object
     """
     if isinstance(time, basestring):
         # parse string into timedelta
-        regex = re.compile(r'((?P<hours>\d*\.*\d+?)hr)?((?P<minutes>\d*\.*\d+?)m)?((?P<seconds>\d*\.*\d+?)s)?')
+        regex = re.compile(r'((?P<hours>\d*\.*\d+?)hr?)?((?P<minutes>\d*\.*\d+?)m)?((?P<seconds>\d*\.*\d+?)s)?')
         parts = regex.match(time)
         if not parts:
             return
@@ -56,100 +67,674 @@ def parse_timedelta(time):
         # assume already in microseconds
         return time
 
-vec_usecs_to_datetime = np.vectorize(usecs_to_datetime)
+OUTPUT_FORMATS = ('pandas', 'numpy')
+ALIGN_MODES = (None, 'native', 'rate', 'nearest', 'linear')
+EXPORT_FORMATS = ('npy', 'hdf5', 'raw')
+
+def _check_output(output):
+    if output not in OUTPUT_FORMATS:
+        raise Exception("Output must be one of {}".format(' or '.join(map(repr, OUTPUT_FORMATS))))
+
+def open_export(path):
+    """
+    Open data written by ``TimeSeries.export`` without reading it into memory.
+    Returns tuple (data, metadata), where data is a read-only memory-mapped
+    (channels x samples) array (or h5py dataset for HDF5 exports).
+    """
+    with open(path + '.json') as f:
+        metadata = json.load(f)
+    if metadata['format'] == 'npy':
+        data = np.load(path, mmap_mode='r')
+    elif metadata['format'] == 'raw':
+        data = np.memmap(path, mode='r', dtype=metadata['dtype'], shape=tuple(metadata['shape']))
+    else:
+        import h5py
+        data = h5py.File(path, 'r')['data']
+    return data, metadata
+
+
+def _combine_channel_chunks(channels, chunks, output):
+    """
+    Combine chunks of several channels into a single DataFrame (or numpy tuple),
+    with a column per channel (NaN where a channel has no data)
+    """
+    if output == 'numpy':
+        return _stack_channel_arrays(chunks)
+    data_map = {c.name: v for c,v in zip(channels,chunks) if v is not None}
+    return pd.DataFrame.from_dict(data_map).reindex(columns=[c.name for c in channels])
+
+def _native_chunk(chunk, output):
+    """
+    Channel chunk as returned with ``align='native'``: a Series, or a
+    ``(values, times)`` tuple (like ``(data, times)`` of other numpy output).
+    Values still pointing into a (read-only) response buffer are copied.
+    """
+    if output == 'numpy':
+        times, values = chunk
+        return values if values.flags.writeable else values.copy(), times
+    return chunk if chunk.values.flags.writeable else chunk.copy()
+
+def _chunk_window(channels, chunk_time=None, use_cache=True):
+    """
+    Chunk time (usecs) for iterating ``channels`` together: ``chunk_time``, but
+    at least the shortest sample period, or by default the shortest page.
+    """
+    if not channels:
+        return chunk_time
+    if chunk_time is None:
+        return min(ch._page_delta(channel_page_size(ch, use_cache)) for ch in channels)
+    return max(long(chunk_time), long(math.ceil(min(1.0e6/ch.rate for ch in channels))))
+
+def _merge_windows(sources):
+    """
+    Generator of per-window lists of chunks (None where a channel has no
+    samples in the window), given ``(window, chunk)`` generators of several
+    channels (see ``ChannelIterator.get_window_chunks``).
+    """
+    heads = [next(s, None) for s in sources]
+    while True:
+        windows = [h[0] for h in heads if h is not None]
+        if not windows:
+            return
+        k = min(windows)
+        values = []
+        for i, head in enumerate(heads):
+            if head is not None and head[0] == k:
+                values.append(head[1])
+                heads[i] = next(sources[i], None)
+            else:
+                values.append(None)
+        yield values
+
+def _concat_chunks(chunks, output, channels=()):
+    """
+    Concatenate consecutive chunks (DataFrames, Series or numpy tuples)
+    of ``channels``
+    """
+    if output == 'numpy':
+        if not chunks:
+            return np.empty((len(channels), 0)), np.empty(0, dtype=np.int64)
+        first, second = zip(*chunks)
+        if first[0].ndim == 1:
+            # per-channel (values, times)
+            return np.concatenate(first), np.concatenate(second)
+        return np.hstack(first), np.concatenate(second)
+    if not chunks:
+        return pd.DataFrame(columns=[c.name for c in channels])
+    return pd.concat(chunks)
+
+def resample_grid(start, rate, k_start, k_stop):
+    """
+    Sample times (usecs) of grid points ``k_start`` to ``k_stop`` of a regular
+    grid at ``rate`` (Hz) anchored at ``start`` (usecs).
+    """
+    period = 1.0e6/rate
+    return start + np.round(np.arange(k_start, k_stop)*period).astype(np.int64)
+
+def resample(times, values, grid, period, method='nearest'):
+    """
+    Resample (times, values) onto grid times, all in usecs. Grid points
+    further than half a sample ``period`` from a sample ('nearest'), or
+    between samples separated by a gap ('linear'), are NaN.
+    """
+    out = np.full(len(grid), np.nan)
+    n = len(times)
+    if n == 0:
+        return out
+    idx = times.searchsorted(grid)
+    hi  = np.minimum(idx, n-1)
+    lo  = np.maximum(idx-1, 0)
+    if method == 'nearest':
+        nearest = np.where(np.abs(times[hi]-grid) < np.abs(grid-times[lo]), hi, lo)
+        valid = np.abs(times[nearest]-grid) <= period/2.0
+        out[valid] = values[nearest[valid]]
+    else:
+        span  = (times[hi]-times[lo]).astype(np.float64)
+        valid = (idx > 0) & (idx < n) & (span > 0) & (span <= 1.5*period)
+        w = (grid[valid]-times[lo[valid]])/span[valid]
+        out[valid] = values[lo[valid]] + w*(values[hi[valid]]-values[lo[valid]])
+        exact = times[hi] == grid
+        out[exact] = values[hi[exact]]
+    return out
+
+
+DECIMATE_MODES = ('minmax', 'lttb')
+
+def minmax_envelope(times, values, start, bucket):
+    """
+    Reduce (times, values) to the minimum and maximum sample of each time
+    bucket of ``bucket`` usecs (buckets are aligned to ``start``). The
+    retained samples are returned in time order.
+    """
+    if not len(times):
+        return times, values
+    ids   = (times - start) // bucket
+    order = np.lexsort((values, ids))
+    ids   = ids[order]
+    first = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    last  = np.r_[first[1:] - 1, len(order) - 1]
+    keep  = np.union1d(order[first], order[last])
+    return times[keep], values[keep]
+
+def lttb(times, values, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling of (times, values) to
+    ``n_out`` samples.
+    """
+    n = len(times)
+    if n_out >= n or n_out < 3:
+        return times, values
+    x = times.astype(np.float64)
+    y = values
+    # buckets over all but first/last sample
+    edges = np.linspace(1, n-1, n_out-1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n-1
+    a = 0
+    for i in xrange(n_out-2):
+        lo, hi = edges[i], edges[i+1]
+        # average point of next bucket (last sample for final bucket)
+        n_lo = hi
+        n_hi = edges[i+2] if i+2 < len(edges) else n
+        avg_x, avg_y = x[n_lo:n_hi].mean(), y[n_lo:n_hi].mean()
+        area = np.abs((x[a]-avg_x)*(y[lo:hi]-y[a]) - (x[a]-x[lo:hi])*(avg_y-y[a]))
+        a = lo + area.argmax()
+        keep[i+1] = a
+    return times[keep], values[keep]
+
+
+AGGREGATE_STATS = ('count', 'mean', 'std', 'rms', 'min', 'max', 'line_length')
+
+class WindowAggregator(object):
+    """
+    Streaming per-window statistics of a channel's ``(times, values)`` chunks
+    (usecs). Windows of ``window`` usecs are aligned to ``start``; the last
+    window of each chunk is kept open, as it may continue in the next chunk.
+
+    Variance is accumulated as the sum of squared deviations from the window
+    mean (merged with Chan's formula), which keeps its precision for values
+    with a large offset.
+    """
+    def __init__(self, start, window):
+        self.start  = start
+        self.window = window
+        # closed windows: list of (ids, count, mean, m2, min, max, line_length)
+        self.closed = []
+        # open window, same fields + last value
+        self.open   = None
+
+    def add(self, times, values):
+        if not len(times):
+            return
+        ids    = (times - self.start) // self.window
+        bounds = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        steps  = np.abs(np.diff(values)) * (ids[1:] == ids[:-1])
+        count  = np.diff(np.r_[bounds, len(ids)])
+        mean   = np.add.reduceat(values, bounds)/count
+        dev    = values - np.repeat(mean, count)
+        acc = [
+            ids[bounds],
+            count,
+            mean,
+            np.add.reduceat(dev*dev, bounds),
+            np.minimum.reduceat(values, bounds),
+            np.maximum.reduceat(values, bounds),
+            np.add.reduceat(np.r_[0.0, steps], bounds),
+        ]
+        if self.open is not None:
+            if self.open[0] == acc[0][0]:
+                # merge open window into first window of chunk
+                n_a, n_b = self.open[1], acc[1][0]
+                n = n_a + n_b
+                delta = acc[2][0] - self.open[2]
+                acc[1][0]  = n
+                acc[2][0]  = self.open[2] + delta*n_b/float(n)
+                acc[3][0] += self.open[3] + delta*delta*n_a*n_b/float(n)
+                acc[4][0]  = min(acc[4][0], self.open[4])
+                acc[5][0]  = max(acc[5][0], self.open[5])
+                acc[6][0] += self.open[6] + abs(values[0] - self.open[7])
+            else:
+                self.closed.append([np.array([x]) for x in self.open[:7]])
+        self.open = [a[-1] for a in acc] + [values[-1]]
+        self.closed.append([a[:-1] for a in acc])
+
+    def result(self, stats):
+        """
+        Returns (window start times, {stat: values}) of all windows with samples.
+        """
+        parts = self.closed
+        if self.open is not None:
+            parts = parts + [[np.array([x]) for x in self.open[:7]]]
+        if parts:
+            ids, n, mean, m2, lo, hi, ll = map(np.concatenate, zip(*parts))
+        else:
+            ids, n, mean, m2, lo, hi, ll = [np.empty(0)]*7
+        n = n.astype(np.float64)
+        columns = {
+            'count':       lambda: n.astype(np.int64),
+            'mean':        lambda: mean,
+            'std':         lambda: np.sqrt(m2/n),
+            'rms':         lambda: np.sqrt(mean*mean + m2/n),
+            'min':         lambda: lo,
+            'max':         lambda: hi,
+            'line_length': lambda: ll,
+        }
+        times = self.start + ids.astype(np.int64)*self.window
+        return times, {stat: columns[stat]() for stat in stats}
+
+
+class ChannelResampler(object):
+    """
+    Resamples a channel's ``(times, values)`` chunks (usecs) onto consecutive
+    blocks of a regular grid, buffering only the samples needed to cover
+    the current block.
+    """
+    def __init__(self, channel, chunks, method='nearest'):
+        self.chunks = chunks
+        self.method = method
+        self.period = 1.0e6/channel.rate
+        self.times  = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0, dtype=np.float64)
+        self.done   = False
+
+    def _fill(self, until):
+        # buffer chunks until there is a sample at/after ``until``
+        times, values = [self.times], [self.values]
+        last = self.times[-1] if len(self.times) else None
+        while not self.done and (last is None or last < until):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.done = True
+                break
+            times.append(chunk[0])
+            values.append(chunk[1])
+            if len(chunk[0]):
+                last = chunk[0][-1]
+        if len(times) > 1:
+            self.times  = np.concatenate(times)
+            self.values = np.concatenate(values)
+
+    def resample(self, grid):
+        if not len(grid):
+            return np.empty(0)
+        self._fill(grid[-1] + self.period)
+        out = resample(self.times, self.values, grid, self.period, self.method)
+        # keep samples that may be needed for next block
+        keep = max(0, self.times.searchsorted(grid[-1]) - 1)
+        self.times  = self.times[keep:]
+        self.values = self.values[keep:]
+        return out
+
+
+def _stack_channel_arrays(chunks):
+    """
+    Combine per-channel ``(times, values)`` chunks into a ``(data, times)``
+    tuple, where ``data`` has one row per channel. Channels with differing
+    sample times are placed on the union of all times (missing samples are NaN).
+    Channels without data (None) are all NaN.
+    """
+    present = [c for c in chunks if c is not None]
+    times = present[0][0]
+    aligned = all(np.array_equal(times, t) for t,_ in present[1:])
+    if not aligned:
+        times = np.unique(np.concatenate([t for t,_ in present]))
+    data = np.full((len(chunks), len(times)), np.nan)
+    for row, chunk in zip(data, chunks):
+        if chunk is None:
+            continue
+        t, v = chunk
+        if aligned:
+            row[:] = v
+        else:
+            row[times.searchsorted(t)] = v
+    return data, times
+
+def page_request_headers():
+    """
+    Headers for continuous data requests. When binary transfer is enabled,
+    the streaming server may respond with a serialized ``CacheSegment``
+    instead of JSON; servers that don't support it will respond with JSON.
+    """
+    if settings.ts_binary_transfer:
+        return {'Accept': '{}, application/json;q=0.9'.format(PROTOBUF_CONTENT_TYPE)}
+    return {'Accept': 'application/json'}
+
+def decode_response(resp):
+    """
+    Returns (times, values) arrays of a data response (binary or JSON),
+    times in nanoseconds, in order.
+    """
+    if isinstance(resp, ProtobufContent):
+        # binary response: serialized CacheSegment (nanosecond index)
+        times, data = read_segment_arrays(resp)
+    elif isinstance(resp, basestring):
+        # neither JSON nor protobuf (e.g. a proxy error page)
+        raise Exception("Unexpected timeseries data response: {!r}".format(resp[:100]))
+    else:
+        # JSON response: [[t, v], ...] decoded in a single pass.
+        # Note: usec timestamps are exact in float64 (up to 2**53).
+        pairs = np.array(resp, dtype=np.float64).reshape(-1, 2)
+        times = pairs[:,0].astype(np.int64) * 1000
+        data  = pairs[:,1]
+
+    # fix -- sometimes API responds out-of-order
+    if len(times) > 1 and (times[1:] < times[:-1]).any():
+        order = np.argsort(times, kind='mergesort')
+        times = times[order]
+        data  = data[order]
+
+    return times, data
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # TimeSeries Request
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
+def _get_page_cache():
+    """
+    Returns the (shared) page cache, initializing it on first use.
+    """
+    global cache
+    if cache is None:
+        with _cache_lock:
+            if cache is None:
+                cache = get_cache(start_compaction=True)
+    return cache
+
+def _flush_page_cache():
+    # buffered access statistics of the shared cache are written at exit
+    if cache is not None:
+        cache.flush_access()
+
+atexit.register(_flush_page_cache)
+
+def channel_page_size(channel, use_cache=True):
+    """
+    Returns page size (samples) of channel, as recorded by the page cache
+    when it is used.
+    """
+    if use_cache:
+        return _get_page_cache().channel_page_size(channel)
+    return adaptive_page_size(channel.rate)
+
 class ChannelPage(object):
-    def __init__(self, channel, page, use_cache=True):
+    """
+    A single page of channel data, retrieved from the cache or API.
+    Page data is a tuple of (times, values) arrays, where times are
+    nanoseconds since Epoch.
+    """
+    def __init__(self, channel, page, use_cache=True, status=None, page_size=None):
         self.channel   = channel
         self.page      = long(page)
         self.use_cache = use_cache
-        
-        global cache, page_size
-        if self.use_cache and cache is None:
-            cache = get_cache(start_compaction=True)
-            page_size = cache.page_size
-        
+        # cache status of page, if known (see ``Cache.page_status``)
+        self.status    = status
+
+        if page_size is None:
+            page_size = channel_page_size(channel, use_cache)
+
         # fixed page -- determined from epoch(0)
         pg_delta = channel._page_delta(page_size)
         self.start = long(self.page  * pg_delta)
         self.stop  = long(self.start + pg_delta)
         self.cache_exists = False
+        # update access statistics when read from cache (unless done for a batch of pages)
+        self.touch = True
 
-        # current future/response
-        self.future = None
-        self.data   = None
+        # API request (for a range of pages) this page is retrieved with
+        self.range = None
+        self.data  = None
+
+    @property
+    def cached(self):
+        """
+        Is page in cache?
+        """
+        if not self.use_cache:
+            return False
+        if self.status is not None:
+            return self.status != PAGE_MISSING
+        return cache.check_page(self.channel, self.page)
+
+    @property
+    def in_flight(self):
+        """
+        Is page waiting on an API response?
+        """
+        return self.range is not None and self.range.future is not None
 
     def request(self, api):
-        # check if page is cached
-        if self.use_cache and cache.check_page(self.channel, self.page):
+        if self.cached:
             # we (should) have cache, skip API request
             self.cache_exists = True
             return
+        PageRange([self]).request(api)
+
+    def get(self, api):
+        if self.data is not None:
+            # we've already got the result
+            pass
+
+        elif self.range is not None:
+            # we're handling an API request/response (sets data of all pages in range)
+            self.range.get(api)
+
+        elif self.use_cache and self.cache_exists:
+            # use existing cache entry
+            has_data = None if self.status is None else self.status == PAGE_PRESENT
+            self.data = cache.get_page_data(self.channel, self.page, has_data=has_data, touch=self.touch)
+
+            if self.data is None:
+                # cache may have disappeared, let's make API call
+                self.status = None
+                self.cache_exists = False
+                PageRange([self], update_cache=True).request(api)
+                self.range.get(api)
+
+        return self.data
+
+
+class PageRange(object):
+    """
+    A single API request for a run of adjacent pages of a channel. The
+    response is split into page-aligned slices, which are cached per page.
+    The ``ChannelIterator`` issuing the request (if any) is notified when
+    it completes or is cancelled.
+    """
+    def __init__(self, pages, update_cache=False, iterator=None):
+        self.pages  = pages
+        self.update_cache = update_cache
+        self.future = None
+        self.iterator = iterator
+        for page in pages:
+            page.range = self
+
+    @property
+    def channel(self):
+        return self.pages[0].channel
 
-        # make request: not using cache
+    def request(self, api):
         args = dict(
             # Note: uses streaming server
             host     = api._streaming_host,
             endpoint = '/ts/retrieve/continuous',
             base     = '',
             async    = True,
+            headers  = page_request_headers(),
             params   = dict(
                 channel = self.channel.id,
                 limit   = '', # required by API
                 session = api.headers.get('X-SESSION-ID'),
-                start   = self.start,
-                end     = self.stop)
+                start   = self.pages[0].start,
+                end     = self.pages[-1].stop)
         )
         self.future = api._get(**args)
+        if self.iterator is not None:
+            self.iterator._request_issued()
+
+    def _done(self):
+        # notify iterator (once)
+        if self.iterator is not None:
+            self.iterator._request_done()
+            self.iterator = None
 
-    def get(self, api, update_cache_if_exists=False):
+    def cancel(self):
+        """
+        Cancel API request (releasing its worker, if not yet started).
+        """
         if self.future is not None:
-            # we're handling an API request/response
-            self.data = self._get_response(api)
+            self.future.cancel()
+            self.future = None
+            self._done()
 
+    def get(self, api):
+        if self.future is None:
+            return
+        try:
+            times, values = self._get_response(api)
+        finally:
+            self._done()
+
+        # split into pages
+        bounds = np.array([p.start for p in self.pages] + [self.pages[-1].stop], dtype=np.int64)*1000
+        idx = times.searchsorted(bounds)
+        for page, i, j in zip(self.pages, idx[:-1], idx[1:]):
+            page.data = times[i:j], values[i:j]
             # set cache!
-            if self.use_cache and (not self.cache_exists or update_cache_if_exists):
-                cache.set_page_data(self.channel, self.page, self.data, update=update_cache_if_exists)
+            if page.use_cache:
+                cache.set_page_data(page.channel, page.page, page.data, update=self.update_cache)
 
-        elif self.data is not None:
-            # we've already got the result
-            pass
+    def _get_response(self, api):
+        # handle API response, return (times, values) arrays
+        resp  = api._get_response(self.future)
+        self.future = None
+        return decode_response(resp)
 
-        elif self.use_cache and self.cache_exists:
-            # use existing cache entry
-            self.data = cache.get_page_data(self.channel, self.page)
 
-            if self.data is None:
-                # cache may have disappeared, let's make API call
-                self.use_cache = False
-                self.cache_exists = False
-                self.request(api)
-                self.data = self.get(api, update_cache_if_exists=True)
+class ChunkBuffer(object):
+    """
+    First-in-first-out buffer of samples backed by preallocated NumPy arrays.
+    Samples are appended page by page and popped as fixed-size chunks; the
+    unread remainder is only moved when the end of the storage is reached.
 
-        return self.data
+    Times are nanoseconds since Epoch.
+    """
+    def __init__(self, capacity):
+        capacity = max(1, int(capacity))
+        self.times  = np.empty(capacity, dtype=np.int64)
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.head   = 0 # first unread sample
+        self.tail   = 0 # end of written samples
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def extend(self, times, values):
+        n = len(times)
+        if self.tail + n > len(self.times):
+            # move remainder to front of storage (growing it if needed)
+            size = len(self)
+            if size + n > len(self.times):
+                capacity = max(size + n, 2*len(self.times))
+                new_times  = np.empty(capacity, dtype=np.int64)
+                new_values = np.empty(capacity, dtype=np.float64)
+            else:
+                new_times, new_values = self.times, self.values
+            new_times[:size]  = self.times[self.head:self.tail]
+            new_values[:size] = self.values[self.head:self.tail]
+            self.times, self.values = new_times, new_values
+            self.head, self.tail = 0, size
+        self.times[self.tail:self.tail+n]  = times
+        self.values[self.tail:self.tail+n] = values
+        self.tail += n
+
+    def first(self):
+        """
+        Time (nanoseconds) of the next buffered sample
+        """
+        return self.times[self.head]
 
-    def _get_response(self, api, datetime_index=True):
-        # handle API response, return data series
-        resp  = api._get_response(self.future)
-        self.future = None
+    def count_before(self, t):
+        """
+        Number of buffered samples before time ``t`` (nanoseconds)
+        """
+        return int(self.times[self.head:self.tail].searchsorted(t))
 
-        # handle data response
-        times = np.array( [t[0] for t in resp] )
-        data  = np.array( [d[1] for d in resp] ) 
-        # fix -- sometimes API responds out-of-order
-        order = np.argsort(times)
-        times = times[order]
-        data  = data[order]
+    def pop(self, n):
+        """
+        Remove and return (times, values) of the next ``n`` samples
+        """
+        n = min(n, len(self))
+        i = self.head
+        self.head += n
+        return self.times[i:i+n].copy(), self.values[i:i+n].copy()
+
+
+class PageScheduler(object):
+    """
+    Issues page requests on behalf of a group of ``ChannelIterator``
+    objects, so that pages for all channels are requested concurrently.
+
+    Channels with read-ahead capacity are queued, and visited round-robin
+    (one request per channel per pass) so that no single channel monopolizes
+    the request pool. No more than ``max_pending`` API requests are kept in
+    flight at once. Iterators keep the count of requests in flight up to
+    date, and rejoin the queue when they consume a page, so the cost of
+    issuing requests doesn't depend on the number of channels.
 
-        if datetime_index and len(times)>0:
-            times = vec_usecs_to_datetime(times)
+    With ``timeout`` (seconds), retrieval fails once the time is exceeded.
+    """
+    def __init__(self, max_pending=None, timeout=None):
+        if max_pending is None:
+            max_pending = settings.ts_max_pending_pages
+        self.max_pending = max(1, int(max_pending))
+        self.iterators   = set()
+        # iterators that may have read-ahead capacity
+        self.ready       = deque()
+        # number of page requests currently in flight (over all channels)
+        self.pending     = 0
+        self.timeout     = timeout
+        self.deadline    = None if timeout is None else time.time() + timeout
+
+    def register(self, iterator):
+        self.iterators.add(iterator)
+        iterator.scheduler = self
+        self.wake(iterator)
+
+    def unregister(self, iterator):
+        # queued entries of unregistered iterators are skipped by ``fill``
+        self.iterators.discard(iterator)
+        iterator.scheduler = None
+
+    def wake(self, iterator):
+        """
+        Queue iterator for requests (e.g. after it consumed a page).
+        """
+        if not iterator._ready:
+            iterator._ready = True
+            self.ready.append(iterator)
 
-        # return pandas series
-        return pd.Series( data=data, index=times, name=self.channel)
+    def check_timeout(self):
+        if self.deadline is not None and time.time() > self.deadline:
+            raise Exception("Timeseries data retrieval exceeded timeout ({} seconds)".format(self.timeout))
+
+    def close(self):
+        """
+        Close all iterators, cancelling their pending page requests.
+        """
+        for iterator in list(self.iterators):
+            iterator.close()
+
+    def fill(self):
+        """
+        Top up page requests for all channels, round-robin.
+        """
+        while self.pending < self.max_pending and self.ready:
+            it = self.ready.popleft()
+            if it.scheduler is not self or it.request_next() is None:
+                # read-ahead window full or no more pages, until woken again
+                it._ready = False
+            else:
+                self.ready.append(it)
 
 
 class ChannelIterator(object):
@@ -158,84 +743,318 @@ class ChannelIterator(object):
     user typically wants data results in some specified "chunk size".
     This accumulates the data pages in order to serve the data back
     in the specified chunk size.
+
+    Up to ``prefetch_pages`` requests (a run of pages retrieved with a
+    single API request, or a cached page) are kept ahead of the page
+    currently being consumed, so that retrieval is pipelined
+    rather than paying a full round trip per page. When registered with
+    a ``PageScheduler``, requests are issued by the scheduler instead.
+
+    With ``chunk_time``, chunks are consecutive windows of ``chunk_time``
+    from ``start``, so that chunks of channels iterated over the same range
+    cover the same time, whatever their page size; windows without samples
+    are skipped (see ``get_window_chunks``). Otherwise, there is a chunk per
+    retrieved page.
+
+    If ``pages`` is given, only those pages (within ``start``/``stop``)
+    are retrieved.
     """
-    def __init__(self, channel, start, stop, chunk_time, api, use_cache=True):
+    def __init__(self, channel, start, stop, chunk_time, api, use_cache=True,
+                 prefetch_pages=None, scheduler=None, output='pandas', pages=None):
         self.channel    = channel
         self.start      = start
         self.stop       = stop
         self.use_cache  = use_cache
         self.api        = api
+        self.output     = output
+
+        # read-ahead depth (pages requested before they are consumed)
+        if prefetch_pages is None:
+            prefetch_pages = settings.ts_prefetch_pages
+        self.prefetch_pages = max(1, int(prefetch_pages))
+        # requests (page runs or cached pages) ahead of the consumer
+        self.outstanding    = 0
+
+        # page size (samples) and delta (usecs) for channel
+        self.page_size  = channel_page_size(channel, use_cache)
+        self.page_delta = channel._page_delta(self.page_size)
+
+        # page iteration, from channel's start (if known); the end isn't
+        # limited, as data may have been added since channel was retrieved
+        page_range_start = self.start
+        if channel.end > channel.start:
+            page_range_start = max(page_range_start, channel.start)
+        self.page_start = long(math.floor(page_range_start/(1.0*self.page_delta)))
+        self.page_end   = max(self.page_start,
+                              long(math.ceil(self.stop/(1.0*self.page_delta))))
+        if pages is None:
+            page_numbers = xrange(self.page_start, self.page_end)
+        else:
+            page_numbers = sorted(p for p in set(pages) if self.page_start <= p < self.page_end)
+        if use_cache:
+            # status of all pages from a single index query, known empty pages are skipped
+            status = cache.page_status(channel, self.page_start, self.page_end)
+            pages = ((p, status[p-self.page_start]) for p in page_numbers
+                     if status[p-self.page_start] != PAGE_EMPTY)
+        else:
+            pages = ((p, None) for p in page_numbers)
+        self._pages     = iter(pages)
+        self._lookahead = None
+        self.pending    = deque()
+
+        # maximum number of pages retrieved with a single request
+        self.max_request_pages = max(1, int(settings.ts_max_request_bytes // (self.page_size*SAMPLE_BYTES)))
 
-        # page delta (usecs) for channel
-        self.page_delta = channel._page_delta(page_size)
+        # number of API requests in flight
+        self.in_flight = 0
 
-        # page iteration
-        self.page_start = long(math.floor(self.start/(1.0*self.page_delta)))
-        self.page_end   = long(math.ceil(self.stop /(1.0*self.page_delta)))
+        # shared request scheduler (optional)
+        self.scheduler = None
+        self._ready    = False
+        if scheduler is not None:
+            scheduler.register(self)
 
         # chunk iteration
         self.chunk_per_page = chunk_time is None
         # chunk over specfied time
         if not self.chunk_per_page:
-            self.chunk_time = long(chunk_time) # in usecs
-            self.chunk_size = long(channel.rate * self.chunk_time/1.0e6)
+            self.chunk_time = max(1, long(chunk_time)) # in usecs
+            # samples per chunk, at least one (chunk time may be shorter than the sample period)
+            self.chunk_size = max(1, long(channel.rate * self.chunk_time/1.0e6))
+            self.n_chunks   = long(math.ceil((self.stop - self.start)/float(self.chunk_time)))
+            # buffered samples: a chunk (at most the whole range) and a page
+            n_range = long(math.ceil(channel.rate * (self.stop - self.start)/1.0e6))
+            self.buffer_size = min(self.chunk_size, n_range) + self.page_size
         self.chunk      = None
 
-    def get_chunks(self):
-        # page size may be more/less than requested data
+    def _request_issued(self):
+        self.in_flight += 1
+        if self.scheduler is not None:
+            self.scheduler.pending += 1
+
+    def _request_done(self):
+        self.in_flight -= 1
+        if self.scheduler is not None:
+            self.scheduler.pending -= 1
+
+    def _next_page(self):
+        if self._lookahead is not None:
+            page, self._lookahead = self._lookahead, None
+            return page
+        p, status = next(self._pages, (None, None))
+        if p is None:
+            return None
+        return ChannelPage(
+                channel   = self.channel,
+                page      = p,
+                use_cache = self.use_cache,
+                status    = status,
+                page_size = self.page_size)
+
+    def request_next(self):
+        """
+        Request the next page, if within the read-ahead window (of
+        ``prefetch_pages`` requests). Adjacent uncached pages (up to ``max_request_pages``) are requested together,
+        cached pages are read ahead within the read-ahead window.
+        Returns the (first) requested page, or None.
+        """
+        if self.outstanding >= self.prefetch_pages:
+            return None
+        page = self._next_page()
+        if page is None:
+            return None
+        if page.cached:
+            # run of cached pages, access statistics are updated together
+            run = [page]
+            while self.outstanding + len(run) < self.prefetch_pages:
+                nxt = self._next_page()
+                if nxt is None:
+                    break
+                if not nxt.cached:
+                    self._lookahead = nxt
+                    break
+                run.append(nxt)
+            for p in run:
+                p.touch = False
+                p.request(self.api)
+            cache.touch_pages(self.channel, [p.page for p in run if p.status == PAGE_PRESENT])
+            self.pending.extend(run)
+            self.outstanding += len(run)
+            return page
+
+        # run of adjacent uncached pages, retrieved with a single request
+        run = [page]
+        while len(run) < self.max_request_pages:
+            nxt = self._next_page()
+            if nxt is None:
+                break
+            if nxt.page != run[-1].page + 1 or nxt.cached:
+                self._lookahead = nxt
+                break
+            run.append(nxt)
+        PageRange(run, iterator=self).request(self.api)
+        self.pending.extend(run)
+        self.outstanding += 1
+        return page
 
-        self.chunk = pd.Series()
-        pages = iter(np.arange(self.page_start, self.page_end))
-        page = None
+    def get_pages(self):
+        """
+        Generator of ``(page, data)`` in page order. Requests are issued
+        ahead of the consumer, keeping ``prefetch_pages`` requests pending.
+        """
         while True:
-            if self.chunk_per_page or \
-               (page is None and len(self.chunk) < self.chunk_size):
-                # get next page
-                try: p = next(pages)
-                except: break
-                page = ChannelPage(
-                        channel   = self.channel,
-                        page      = p,
-                        use_cache = self.use_cache)
-                page.request(self.api)
-                data = page.get(self.api)
-                # no more data
-                if data is None: break
-                # grow data series
-                i_start = None
-                i_stop  = None
-                if page.start < self.start:
-                    i_start = usecs_to_datetime(self.start)
-                if page.stop > self.stop:
-                    i_stop = usecs_to_datetime(self.stop-1)
-                else:
-                    # more pages needed - reset
-                    page = None
-                data_slice = data.ix[i_start:i_stop]
-                if self.chunk_per_page:
-                    yield data_slice
-                else:
-                    self.chunk = self.chunk.append(data_slice)
+            # top up read-ahead window
+            if self.scheduler is not None:
+                self.scheduler.fill()
             else:
-                # return full chunk
-                if not self.chunk_per_page:
-                    yield self._get_chunk()
+                while self.request_next() is not None:
+                    pass
+
+            if not self.pending:
+                # scheduler may be saturated by other channels
+                if self.request_next() is None:
+                    break
+
+            if self.scheduler is not None:
+                self.scheduler.check_timeout()
+
+            # block on oldest page only
+            page = self.pending.popleft()
+            if page.range is None or page is page.range.pages[-1]:
+                # last page of its request
+                self.outstanding -= 1
+            if self.scheduler is not None:
+                # read-ahead capacity freed
+                self.scheduler.wake(self)
+            yield page, page.get(self.api)
+
+    def close(self):
+        """
+        Stop iteration, cancelling pending page requests.
+        """
+        for page in self.pending:
+            if page.in_flight:
+                page.range.cancel()
+        self.pending.clear()
+        self.outstanding = 0
+        self._pages = iter(())
+        self._lookahead = None
+        if self.scheduler is not None:
+            self.scheduler.unregister(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_chunks(self):
+        """
+        Generator of chunks, in order (see ``get_window_chunks``).
+        """
+        try:
+            for _, chunk in self._get_chunks():
+                yield chunk
+        finally:
+            # also when consumer stops early
+            self.close()
 
-        # return remaining chunk
+    def get_window_chunks(self):
+        """
+        Generator of ``(window, chunk)``, where ``window`` is the index of the
+        chunk's ``chunk_time`` window from ``start`` (or of the page chunk).
+        Windows without samples are skipped.
+        """
+        try:
+            for item in self._get_chunks():
+                yield item
+        finally:
+            # also when consumer stops early
+            self.close()
+
+    def _get_chunks(self):
+        # page size may be more/less than requested data
         if not self.chunk_per_page:
-            yield self._get_chunk()
+            self.chunk = ChunkBuffer(capacity=self.buffer_size)
+        k = 0
+
+        for page, data in self.get_pages():
+            # no more data
+            if data is None: break
+            # trim page to requested range
+            times, values = data
+            i_start = times.searchsorted(self.start*1000) if page.start < self.start else 0
+            i_stop  = times.searchsorted(self.stop *1000) if page.stop  > self.stop  else len(times)
+            if self.chunk_per_page:
+                yield k, self._make_chunk(times[i_start:i_stop], values[i_start:i_stop])
+                k += 1
+                continue
+            # serve chunks up to the end of page (skipped pages have no samples)
+            self.chunk.extend(times[i_start:i_stop], values[i_start:i_stop])
+            for item in self._serve_chunks(page.stop):
+                yield item
+
+        # return remaining chunks
+        if not self.chunk_per_page:
+            for item in self._serve_chunks(self.stop):
+                yield item
+
+    def _serve_chunks(self, until):
+        # windows ending by ``until`` (usecs) with buffered samples
+        while len(self.chunk):
+            # skip ahead to the window of the next sample
+            k = (self.chunk.first()//1000 - self.start) // self.chunk_time
+            if k >= self.n_chunks or self._chunk_end(k) > until:
+                break
+            yield k, self._get_chunk(k)
+
+    def _chunk_end(self, k):
+        return min(self.start + (k+1)*self.chunk_time, self.stop)
+
+    def _get_chunk(self, k):
+        n = self.chunk.count_before(self._chunk_end(k)*1000)
+        return self._make_chunk(*self.chunk.pop(n))
 
-    def _get_chunk(self):
-        d = self.chunk.ix[:self.chunk_size]
-        # leave remainder
-        self.chunk = self.chunk.ix[self.chunk_size:]
-        return d if len(d) else None
+    def _make_chunk(self, times, values):
+        if self.output == 'numpy':
+            # (usecs, values)
+            return times // 1000, values
+        index = pd.DatetimeIndex(times.view('datetime64[ns]'))
+        return pd.Series(data=values, index=index, name=self.channel.name)
 
     def __repr__(self):
         return "<ChannelIterator channel='{}' range=({},{})>".format(
                     self.channel.id, self.start, self.stop)
 
 
+class TimeSeriesDataIterator(object):
+    """
+    Iterator over chunks of timeseries data (see ``TimeSeries.get_data_iter``).
+    Closing it, or leaving a ``with`` block, cancels pending page requests.
+    ``channels`` are the channels retrieved, in order of the data.
+    """
+    def __init__(self, chunks, scheduler, channels):
+        self._chunks   = chunks
+        self.scheduler = scheduler
+        self.channels  = channels
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self._chunks)
+
+    def close(self):
+        self._chunks.close()
+        self.scheduler.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Time Series API
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -244,6 +1063,11 @@ class TimeSeriesAPI(APIBase):
     base_uri = "/timeseries"
     name = 'timeseries'
 
+    def __init__(self, session):
+        super(TimeSeriesAPI, self).__init__(session)
+        # channel metadata per package: {package_id: (time, channels)}
+        self._channel_cache = {}
+
     # ~~~~~~~~~~~~~~~~~~~
     # Channels
     # ~~~~~~~~~~~~~~~~~~~
@@ -256,6 +1080,7 @@ class TimeSeriesAPI(APIBase):
             return channel
         ts_id = self._get_id(ts)
         resp = self._post( self._uri('/{id}/channels', id=ts_id), json=channel.as_dict())
+        self.invalidate_channels(ts_id)
 
         ch = TimeSeriesChannel.from_dict(resp, api=self.session)
         ch._pkg = ts.id
@@ -273,6 +1098,27 @@ class TimeSeriesAPI(APIBase):
             ch._pkg = ts_id
         return chs
 
+    def get_cached_channels(self, ts):
+        """
+        Returns channels for a timeseries package, using channel metadata
+        retrieved within the last ``ts_channel_cache_ttl`` seconds if available.
+        Callers get copies, so changes to them don't affect the cached channels.
+        """
+        ts_id = self._get_id(ts)
+        ttl = settings.ts_channel_cache_ttl
+        cached = self._channel_cache.get(ts_id)
+        if cached is None or not ttl or time.time() - cached[0] > ttl:
+            cached = (time.time(), self.get_channels(ts_id))
+            self._channel_cache[ts_id] = cached
+        # copy channel metadata, sharing the API session
+        return [copy.deepcopy(ch, {id(ch._api): ch._api}) for ch in cached[1]]
+
+    def invalidate_channels(self, ts):
+        """
+        Clear cached channel metadata of a timeseries package.
+        """
+        self._channel_cache.pop(self._get_id(ts), None)
+
     def get_channel(self, pkg, channel):
         """
         Returns a channel object from the platform.
@@ -298,6 +1144,7 @@ class TimeSeriesAPI(APIBase):
         path = self._uri('/{pkg_id}/channels/{id}', pkg_id=pkg_id, id=ch_id)
 
         resp = self._put(path , json=channel.as_dict())
+        self.invalidate_channels(pkg_id)
 
         ch = TimeSeriesChannel.from_dict(resp, api=self.session)
         ch._pkg = pkg_id
@@ -314,6 +1161,7 @@ class TimeSeriesAPI(APIBase):
         path = self._uri('/{pkg_id}/channels/{id}/properties', pkg_id=pkg_id, id=ch_id)
 
         resp = self._put(path , json=[m.as_dict() for m in channel.properties])
+        self.invalidate_channels(pkg_id)
 
         ch = TimeSeriesChannel.from_dict(resp, api=self.session)
         ch._pkg = pkg_id
@@ -328,7 +1176,22 @@ class TimeSeriesAPI(APIBase):
         pkg_id = self._get_id(channel._pkg)
         path = self._uri('/{pkg_id}/channels/{id}', pkg_id=pkg_id, id=ch_id)
 
-        return self._del(path)
+        resp = self._del(path)
+        self.invalidate_channels(pkg_id)
+        return resp
+
+    def get_segments(self, channel, start=None, end=None):
+        """
+        Returns known contiguous ranges (start, end) of channel data, in usecs.
+        Segments are learned from data pages retrieved through the page cache.
+        """
+        return _get_page_cache().get_segments(channel, start=start, end=end)
+
+    def get_gaps(self, channel, start=None, end=None):
+        """
+        Returns known ranges (start, end) without channel data, in usecs.
+        """
+        return _get_page_cache().get_gaps(channel, start=start, end=end)
 
     def get_streaming_credentials(self, ts):
         """
@@ -348,7 +1211,8 @@ class TimeSeriesAPI(APIBase):
     # ~~~~~~~~~~~~~~~~~~~
 
     def get_ts_data_iter(self, ts, start, end, channels, chunk_size, 
-                         use_cache,length=None):
+                         use_cache,length=None, output='pandas', align=None, rate=None,
+                         timeout=None):
         """
         Iterator will be constructed based over timespan (start,end) or (start, start+seconds)
 
@@ -357,87 +1221,549 @@ class TimeSeriesAPI(APIBase):
           3 minutes = '3m'
           1 hour    = '1h'
         otherwise microseconds assumed.
+
+        With ``output='numpy'``, each chunk is a tuple ``(data, times)`` where
+        ``data`` is a (channels x samples) float array and ``times`` holds the
+        sample times in microseconds since Epoch.
+
+        Channels are combined according to ``align``:
+          None      = outer join on sample times
+          'native'  = no alignment, dict of per-channel chunks (by channel name),
+                      ``(values, times)`` tuples with ``output='numpy'``
+          'rate'    = channels combined per sampling rate, dict keyed by rate
+          'nearest' = resampled to ``rate`` (default: highest channel rate)
+          'linear'  = linearly interpolated to ``rate``
+
+        The returned iterator can be closed (or used as a context manager) to
+        stop early, which cancels pending page requests. With ``timeout``
+        (seconds), iteration fails once the time is exceeded.
+        """
+        _check_output(output)
+        if align not in ALIGN_MODES:
+            raise Exception("Align must be one of {}".format(', '.join(map(str, ALIGN_MODES))))
+
+        channels, the_start, the_end = self._data_query(ts, start, end, length, channels)
+
+        # chunk 
+        if chunk_size is not None and isinstance(chunk_size, basestring):
+            chunk_size = parse_timedelta(chunk_size)
+
+        # page requests for all channels are issued concurrently
+        scheduler = PageScheduler(timeout=timeout)
+        chunks = self._ts_data_chunks(scheduler, channels, the_start, the_end, chunk_size,
+                                      use_cache, output, align, rate)
+        return TimeSeriesDataIterator(chunks, scheduler, channels)
+
+    def _ts_data_chunks(self, scheduler, channels, the_start, the_end, chunk_size,
+                        use_cache, output, align, rate):
+        try:
+            if align in ('nearest', 'linear'):
+                # resample all channels onto a common grid
+                if rate is None:
+                    rate = max(ch.rate for ch in channels)
+                resamplers = [
+                    ChannelResampler(ch, ChannelIterator(ch, the_start, the_end, None,
+                                        api=self.session, use_cache=use_cache,
+                                        scheduler=scheduler, output='numpy').get_chunks(),
+                                     method=align)
+                    for ch in channels
+                ]
+                if chunk_size is None:
+                    n_window = settings.max_points_per_chunk
+                else:
+                    n_window = max(1, long(round(chunk_size*rate/1.0e6)))
+                n_total = long(math.ceil((the_end-the_start)*rate/1.0e6))
+                for k in xrange(0, n_total, n_window):
+                    grid = resample_grid(the_start, rate, k, min(k+n_window, n_total))
+                    data = np.vstack([r.resample(grid) for r in resamplers])
+                    if output == 'numpy':
+                        yield data, grid
+                    else:
+                        index = pd.DatetimeIndex(grid.astype('datetime64[us]'))
+                        yield pd.DataFrame(data.T, index=index, columns=[ch.name for ch in channels])
+                return
+
+            # chunks of all channels cover the same time windows
+            window = _chunk_window(channels, chunk_size, use_cache)
+            channel_chunks = [
+                ChannelIterator(ch, the_start, the_end, window,
+                                api=self.session, use_cache=use_cache,
+                                scheduler=scheduler, output=output).get_window_chunks()
+                for ch in channels
+            ]
+
+            if align == 'rate':
+                # channels grouped by sampling rate, combined within group only
+                groups = {}
+                for ch in channels:
+                    groups.setdefault(ch.rate, []).append(ch)
+
+            # chunks of all channels per window with samples (e.g. not a gap of all channels)
+            for values in _merge_windows(channel_chunks):
+                if align == 'native':
+                    yield {c.name: _native_chunk(v, output) for c,v in zip(channels,values) if v is not None}
+                elif align == 'rate':
+                    by_channel = {c.id: v for c,v in zip(channels,values)}
+                    yield {
+                        r: _combine_channel_chunks(group, [by_channel[c.id] for c in group], output)
+                        for r, group in groups.iteritems()
+                        if any(by_channel[c.id] is not None for c in group)
+                    }
+                else:
+                    yield _combine_channel_chunks(channels, values, output)
+        finally:
+            scheduler.close()
+
+    def get_ts_data(self, ts, start, end, length, channels, use_cache, output='pandas',
+                    align=None, rate=None, timeout=None):
+        """
+        Retrieve data. Must specify end-time or length.
+        """
+        ts_iter = self.get_ts_data_iter(ts=ts, start=start, end=end, channels=channels,
+                                         chunk_size=None, use_cache=use_cache, length=length,
+                                         output=output, align=align, rate=rate, timeout=timeout)
+        # collect chunks, combine once (appending would copy on every chunk)
+        frames = list(ts_iter)
+        if align in ('native', 'rate'):
+            # chunks are dicts, combine per key
+            keys = set(k for f in frames for k in f)
+            return {k: _concat_chunks([f[k] for f in frames if k in f], output) for k in keys}
+        return _concat_chunks(frames, output, ts_iter.channels)
+
+    def get_ts_data_async(self, ts, start, end, length, channels, use_cache, **kwargs):
+        """
+        Retrieve data in the background. Returns a ``concurrent.futures.Future``
+        which resolves to the result of ``get_ts_data``.
+
+        Note: this runs ``get_ts_data`` on a worker thread, it doesn't add request
+        concurrency. Page requests in flight (over all retrievals) are limited by
+        the ``max_request_workers`` request workers of the session.
+        """
+        return self._executor.submit(self.get_ts_data, ts, start=start, end=end, length=length,
+                                     channels=channels, use_cache=use_cache, **kwargs)
+
+    def get_ts_data_many(self, packages, start=None, end=None, length=None, channel_names=None,
+                         use_cache=True, output='pandas'):
+        """
+        Retrieve the same window from many packages. Generator of ``(ts, data)``
+        tuples, in the order that packages complete.
+
+        ``start``/``end`` given as strings or timedeltas (e.g. '10m') are relative
+        to each package's start, otherwise they are absolute. Package and channel
+        metadata is resolved concurrently, and page requests for all packages
+        share a single ``PageScheduler``.
+        """
+        _check_output(output)
+
+        resolve = lambda pkg: self._relative_query(pkg, start, end, length, channel_names)
+        workers = max(1, min(settings.max_request_workers, len(packages)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            queries = [f.result() for f in as_completed([pool.submit(resolve, p) for p in packages])]
+
+        scheduler = PageScheduler()
+        active = []
+        for ts, channels, the_start, the_end in queries:
+            # chunks of all channels cover the same time windows
+            window = _chunk_window(channels, None, use_cache)
+            iterators = [
+                ChannelIterator(ch, the_start, the_end, window,
+                                api=self.session, use_cache=use_cache,
+                                scheduler=scheduler, output=output)
+                for ch in channels
+            ]
+            windows = _merge_windows([it.get_window_chunks() for it in iterators])
+            active.append((ts, channels, iterators, windows, []))
+
+        # one chunk per package per pass; packages are yielded once exhausted
+        try:
+            while active:
+                for item in list(active):
+                    ts, channels, iterators, windows, frames = item
+                    values = next(windows, None)
+                    if values is not None:
+                        frames.append(_combine_channel_chunks(channels, values, output))
+                        continue
+                    active.remove(item)
+                    yield ts, _concat_chunks(frames, output, channels)
+        finally:
+            # also when consumer stops early
+            scheduler.close()
+
+    def _relative_query(self, ts, start, end, length, channel_names):
+        """
+        Resolve package, channels (by name) and time range, where relative
+        times are offsets from the package start. Returns tuple
+        (ts, channels, start, end).
         """
         if isinstance(ts, basestring):
-            # assumed to be package ID
             ts = self.session.core.get(ts)
-
-        #CHANNELS
         ts_channels = ts.channels
-
-        #no channels specified
-        if channels is None:
-            channels = ts.channels
-        #1 channel specified as TSC object
-        elif isinstance(channels,TimeSeriesChannel):
-            channels = [channels]
-        #1 channel specified and channel id
-        elif isinstance(channels,basestring):
-            channels = [ch for ch in ts.channels if ch.id==channels]
-        #list of channel ids OR ts channels
+        if channel_names is None:
+            channels = ts_channels
         else:
-            all_ch = []
-            for chan in channels:
-                if isinstance(chan,basestring):
-                    all_ch.extend([ch for ch in ts_channels if ch.id==chan])
-                else:
-                    all_ch.extend([ch for ch in ts_channels if ch==chan])
-            channels = all_ch
+            if isinstance(channel_names, basestring):
+                channel_names = [channel_names]
+            channels = [ch for ch in ts_channels if ch.name in channel_names]
 
-        # determine start (usecs)
-        the_start = ts.start if start is None else infer_epoch(start)
+        ts_start = min(ch.start for ch in ts_channels) if ts_channels else 0
+        ts_end   = max(ch.end   for ch in ts_channels) if ts_channels else 0
 
-        # chunk 
-        if chunk_size is not None and isinstance(chunk_size, basestring):
-            chunk_size = parse_timedelta(chunk_size)
+        def resolve(t, default):
+            if t is None:
+                return default
+            if isinstance(t, (basestring, datetime.timedelta)):
+                return ts_start + parse_timedelta(t)
+            return infer_epoch(t)
 
-        # determine end
+        the_start = resolve(start, ts_start)
         if length is not None:
-            if isinstance(length, basestring):
-                length_usec = parse_timedelta(length)
-            else:
-                length_usec = length
-            the_end = the_start + length_usec
+            the_end = the_start + parse_timedelta(length)
+        else:
+            the_end = resolve(end, ts_end)
+
+        if the_end < the_start:
+            raise Exception("End time cannot be before start time.")
+        return ts, channels, long(the_start), long(the_end)
+
+    @property
+    def _executor(self):
+        if self.__dict__.get('_data_executor') is None:
+            self._data_executor = ThreadPoolExecutor(max_workers=settings.max_request_workers)
+        return self._data_executor
+
+    def _channel_chunks(self, channels, start, end, use_cache, timeout=None, pages=None):
+        """
+        Generator of (channel index, chunk) for all ``channels`` over
+        [start, end), as numpy (usecs, values) page chunks. Pages of all
+        channels are requested concurrently and consumed in step, so they can
+        be reduced as they arrive. Pending requests are cancelled when the
+        generator is closed.
+
+        ``pages``, if given, is a list of page numbers to retrieve per channel.
+        """
+        scheduler = PageScheduler(timeout=timeout)
+        try:
+            sources = [
+                ChannelIterator(ch, start, end, None,
+                                api=self.session, use_cache=use_cache, scheduler=scheduler,
+                                output='numpy', pages=None if pages is None else pages[i]).get_chunks()
+                for i, ch in enumerate(channels)
+            ]
+            active = range(len(channels))
+            while active:
+                for i in list(active):
+                    chunk = next(sources[i], None)
+                    if chunk is None:
+                        active.remove(i)
+                        continue
+                    yield i, chunk
+        finally:
+            scheduler.close()
+
+    def get_ts_windows(self, ts, windows, channels, use_cache, rate=None, timeout=None):
+        """
+        Retrieve many (possibly overlapping) time windows at once. Every page
+        needed by any window is retrieved once, concurrently.
 
+        Returns a (windows x channels x samples) array, where sample ``k`` of
+        window ``i`` is the sample nearest to ``start_i + k/rate`` (NaN if
+        missing, or past the end of a shorter window). ``rate`` defaults to
+        the highest channel rate.
+        """
+        windows = np.array([(infer_epoch(a), infer_epoch(b)) for a, b in windows], dtype=np.int64).reshape(-1, 2)
+        if (windows[:,1] < windows[:,0]).any():
+            raise Exception("End time cannot be before start time.")
+        if not len(windows):
+            return np.empty((0, 0, 0))
+        starts, ends = windows[:,0], windows[:,1]
+        channels, the_start, the_end = self._data_query(ts, starts.min(), ends.max(), None, channels)
+
+        if rate is None:
+            rate = max(ch.rate for ch in channels) if channels else 1.0
+        period = 1.0e6/rate
+        n_samples = long(math.ceil((ends-starts).max()/period))
+        grid = starts[:,None] + np.round(np.arange(n_samples)*period).astype(np.int64)
+        outside = grid >= ends[:,None]
+
+        # pages needed for any window
+        channel_pages = []
+        for ch in channels:
+            delta = ch._page_delta(channel_page_size(ch, use_cache))
+            pages = set()
+            for first, last in zip(starts//delta, (ends-1)//delta):
+                pages.update(xrange(first, last+1))
+            channel_pages.append(pages)
+
+        page_data = [[] for ch in channels]
+        with closing(self._channel_chunks(channels, the_start, the_end, use_cache,
+                                          timeout=timeout, pages=channel_pages)) as chunks:
+            for i, chunk in chunks:
+                if len(chunk[0]):
+                    page_data[i].append(chunk)
+
+        # slice all windows out of each channel at once
+        data = np.full((len(windows), len(channels), n_samples), np.nan)
+        for i, pages in enumerate(page_data):
+            if not pages:
+                continue
+            times, values = map(np.concatenate, zip(*pages))
+            out = resample(times, values, grid.ravel(), 1.0e6/channels[i].rate).reshape(grid.shape)
+            out[outside] = np.nan
+            data[:,i,:] = out
+        return data
+
+    def get_ts_events(self, channel, start=None, end=None, length=None, use_cache=True,
+                      values=False, page_size=None):
+        """
+        Retrieve event times (usecs since Epoch) of an event (e.g. spike) channel
+        as an int64 array, or tuple (times, values) when ``values`` is set.
+
+        Events are requested in pages of at most ``page_size`` events (default:
+        ``ts_event_page_size``), each continuing after the last event of the
+        previous page. Retrieved ranges are cached as event blocks, independently
+        of the time-aligned pages of continuous data.
+        """
+        page_size = settings.ts_event_page_size if page_size is None else page_size
+        the_start = channel.start if start is None else infer_epoch(start)
+        if length is not None:
+            the_end = the_start + parse_timedelta(length)
         elif end is not None:
             the_end = infer_epoch(end)
         else:
-            the_end = ts.end
-
-        # logical check
+            # include event at channel end
+            the_end = channel.end + 1
         if the_end < the_start:
             raise Exception("End time cannot be before start time.")
+        the_start, the_end = long(the_start), long(the_end)
+
+        blocks = _get_page_cache().get_event_blocks(channel, the_start, the_end) if use_cache else []
+        chunks = []
+        t = the_start
+        while t < the_end:
+            block = next((b for b in blocks if b[0] <= t < b[1]), None)
+            data = None
+            if block is not None:
+                data = cache.get_event_block_data(channel, block[0], block[2])
+            if data is not None:
+                block_times, block_values = data
+                i, j = block_times.searchsorted([t, the_end])
+                chunks.append((block_times[i:j], block_values[i:j]))
+                t = block[1]
+                continue
+            elif block is not None:
+                # block file has disappeared
+                blocks.remove(block)
+
+            # request events up to the next cached block
+            stop = min([the_end] + [b[0] for b in blocks if b[0] > t])
+            times, vals = self._request_events(channel, t, stop, page_size)
+            if len(times) >= page_size:
+                # page is full: more events may share its last timestamp
+                last = long(times[-1])
+                if times[0] == last:
+                    # a single timestamp with more events than a page, get all of them
+                    stop = last + 1
+                    times, vals = self._request_events(channel, t, stop, None)
+                else:
+                    # continue at the last timestamp
+                    stop = last
+                    keep = times.searchsorted(last)
+                    times, vals = times[:keep], vals[:keep]
+            chunks.append((times, vals))
+            if use_cache:
+                cache.set_event_block(channel, t, stop, times, vals)
+            t = stop
+
+        if chunks:
+            times, vals = map(np.concatenate, zip(*chunks))
+        else:
+            times, vals = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.double)
+        return (times, vals) if values else times
 
-        # loop through chunks
-        the_start = long(the_start)
-        the_end = long(the_end)
+    def _request_events(self, channel, start, end, limit):
+        # at most ``limit`` (None: all) events in range [start, end), times in usecs
+        resp = self.session._get(
+            host     = self.session._streaming_host,
+            endpoint = '/ts/retrieve/continuous',
+            base     = '',
+            headers  = page_request_headers(),
+            params   = dict(
+                channel = channel.id,
+                limit   = '' if limit is None else limit,
+                session = self.session.headers.get('X-SESSION-ID'),
+                start   = start,
+                end     = end))
+        times, vals = decode_response(resp)
+        if limit is not None:
+            # servers without limit support return the whole range
+            times, vals = times[:limit], vals[:limit]
+        return times//1000, vals
+
+    def get_ts_data_decimated(self, ts, start, end, length, channels, use_cache, max_points,
+                              method='minmax', output='pandas', timeout=None):
+        """
+        Retrieve at most ``max_points`` samples per channel over the requested range.
+        Each page is reduced to its min/max envelope as it is retrieved, so memory
+        use does not depend on the length of the range.
 
-        channel_chunks = [
-            ChannelIterator(ch, the_start, the_end, chunk_size,
-                            api=self.session, use_cache=use_cache).get_chunks()
-            for ch in channels
-        ]
+        Methods:
+          'minmax' = minimum and maximum sample of ``max_points/2`` time buckets
+          'lttb'   = largest-triangle-three-buckets, applied to the min/max envelope
+        """
+        if method not in DECIMATE_MODES:
+            raise Exception("Decimate must be one of {}".format(', '.join(DECIMATE_MODES)))
+        _check_output(output)
 
-        while True:
-            # get chunk for all channels
-            values = [next(i, None) for i in channel_chunks]
-            # no more results?
-            if not [1 for v in values if v is not None]:
-                break
-            # make dataframe 
-            data_map = {c.name: v for c,v in zip(channels,values) if v is not None}
-            yield pd.DataFrame.from_dict(data_map) 
+        channels, the_start, the_end = self._data_query(ts, start, end, length, channels)
+
+        max_points = max(1, int(max_points))
+        n_buckets = max(1, max_points//2) if method == 'minmax' else max_points
+        bucket = max(1, long(math.ceil((the_end-the_start)/float(n_buckets))))
 
-    def get_ts_data(self, ts, start, end, length, channels, use_cache):
+        envelopes = [[] for ch in channels]
+        with closing(self._channel_chunks(channels, the_start, the_end, use_cache, timeout)) as chunks:
+            for i, chunk in chunks:
+                envelopes[i].append(minmax_envelope(chunk[0], chunk[1], the_start, bucket))
+
+        results = []
+        for envelope in envelopes:
+            if envelope:
+                times, values = map(np.concatenate, zip(*envelope))
+            else:
+                times, values = np.empty(0, dtype=np.int64), np.empty(0)
+            # merge buckets split across pages
+            times, values = minmax_envelope(times, values, the_start, bucket)
+            if method == 'lttb':
+                times, values = lttb(times, values, max_points)
+            results.append((times, values))
+
+        if output == 'numpy':
+            if not any(len(t) for t,_ in results):
+                return np.empty((len(channels), 0)), np.empty(0, dtype=np.int64)
+            return _stack_channel_arrays(results)
+        return pd.DataFrame.from_dict({
+            ch.name: pd.Series(values, index=pd.DatetimeIndex(times.astype('datetime64[us]')))
+            for ch, (times, values) in zip(channels, results)
+        })
+
+    def get_ts_aggregate(self, ts, stats, window, start, end, length, channels, use_cache,
+                         timeout=None):
         """
-        Retrieve data. Must specify end-time or length.
+        Compute statistics of each channel over consecutive windows of ``window``
+        (e.g. '1s', or usecs), aligned to ``start``. Pages are reduced as they are
+        retrieved, so memory use does not depend on the length of the range.
+
+        Returns a DataFrame indexed by window start, with a column per
+        (channel name, statistic). Windows without samples are NaN (with a
+        count of 0).
         """
-        ts_iter = self.get_ts_data_iter(ts=ts, start=start, end=end, channels=channels,
-                                         chunk_size=None, use_cache=use_cache, length=length)
-        df = pd.DataFrame()
-        for tmp_df in ts_iter:
-            df = df.append(tmp_df)
-        return df
+        if isinstance(stats, basestring):
+            stats = [stats]
+        for stat in stats:
+            if stat not in AGGREGATE_STATS:
+                raise Exception("Statistics must be one of {}".format(', '.join(AGGREGATE_STATS)))
+        window = parse_timedelta(window)
+        if not window or window <= 0:
+            raise Exception("Window must be a positive time length")
+
+        channels, the_start, the_end = self._data_query(ts, start, end, length, channels)
+
+        aggregators = [WindowAggregator(the_start, long(window)) for ch in channels]
+        with closing(self._channel_chunks(channels, the_start, the_end, use_cache, timeout)) as chunks:
+            for i, chunk in chunks:
+                aggregators[i].add(chunk[0], chunk[1])
+
+        # all windows of the range, including those without samples
+        n_windows = long(math.ceil((the_end - the_start)/float(window)))
+        grid = the_start + np.arange(n_windows, dtype=np.int64)*long(window)
+        index = pd.DatetimeIndex(grid.astype('datetime64[us]'))
+        frames = []
+        for aggregator in aggregators:
+            times, columns = aggregator.result(stats)
+            frame = pd.DataFrame(columns, columns=stats,
+                                 index=pd.DatetimeIndex(times.astype('datetime64[us]'))).reindex(index)
+            if 'count' in stats:
+                frame['count'] = frame['count'].fillna(0).astype(np.int64)
+            frames.append(frame)
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, axis=1, keys=[ch.name for ch in channels])
+
+    def export_ts_data(self, ts, path, start, end, length, channels, format='npy',
+                       use_cache=False, timeout=None):
+        """
+        Stream data into a (channels x samples) float64 array on disk, one page
+        at a time. Each channel's samples are placed on its own sampling grid,
+        starting at ``start``; rows of lower-rate channels are padded, and missing
+        samples are NaN.
+
+        A JSON sidecar (``path + '.json'``) describes the layout: format, shape,
+        channel names/IDs, rates, number of samples and start time per channel.
+
+        With ``timeout`` (seconds), the export fails once the time is exceeded.
+        """
+        if format not in EXPORT_FORMATS:
+            raise Exception("Format must be one of {}".format(', '.join(EXPORT_FORMATS)))
+
+        channels, the_start, the_end = self._data_query(ts, start, end, length, channels)
+        n_samples = [long(math.ceil((the_end-the_start)*ch.rate/1.0e6)) for ch in channels]
+        shape = (len(channels), max(n_samples) if n_samples else 0)
+
+        if format == 'hdf5':
+            try:
+                import h5py
+            except ImportError:
+                raise Exception("Exporting to HDF5 requires the h5py package")
+            h5 = h5py.File(path, 'w')
+            out = h5.create_dataset('data', shape=shape, dtype='<f8', fillvalue=np.nan, chunks=True)
+        else:
+            if format == 'npy':
+                out = np.lib.format.open_memmap(path, mode='w+', dtype='<f8', shape=shape)
+            else:
+                out = np.memmap(path, mode='w+', dtype='<f8', shape=shape)
+            for row in out:
+                row[:] = np.nan
+
+        metadata = dict(
+            format  = format,
+            dtype   = '<f8',
+            shape   = shape,
+            start   = the_start,
+            end     = the_end,
+            channels = [dict(
+                id        = ch.id,
+                name      = ch.name,
+                rate      = ch.rate,
+                unit      = ch.unit,
+                start     = the_start,
+                n_samples = n,
+            ) for ch, n in zip(channels, n_samples)]
+        )
+
+        try:
+            with closing(self._channel_chunks(channels, the_start, the_end, use_cache, timeout)) as chunks:
+                for i, (times, values) in chunks:
+                    if not len(times):
+                        continue
+                    # position on channel's sample grid
+                    idx = np.round((times-the_start)*(channels[i].rate/1.0e6)).astype(np.int64)
+                    valid = (idx >= 0) & (idx < n_samples[i])
+                    idx, values = idx[valid], values[valid]
+                    if not len(idx):
+                        continue
+                    block = np.full(idx[-1]-idx[0]+1, np.nan)
+                    block[idx-idx[0]] = values
+                    out[i, idx[0]:idx[-1]+1] = block
+        finally:
+            if format == 'hdf5':
+                h5.close()
+            else:
+                out.flush()
+                del out
+
+        with open(path + '.json', 'w') as f:
+            json.dump(metadata, f, indent=2)
+        return metadata
 
     def stream_data(self, ts, dataframe):
         """
@@ -780,10 +2106,11 @@ class TimeSeriesAPI(APIBase):
             layers = new_layers
 
         to_write = []
+        ts_channels = ts.channels
         for l in layers:
             annot = l.annotations()
             for a in annot:
-                channels = [ch.name for ch in ts.channels if ch.id in a.channel_ids]
+                channels = [ch.name for ch in ts_channels if ch.id in a.channel_ids]
                 channel_names = ";".join(channels)
                 tmp = {
                     'layer_name' : l.name,
@@ -807,6 +2134,61 @@ class TimeSeriesAPI(APIBase):
     # Helpers
     # ~~~~~~~~~~~~~~~~~~~
 
+    def _data_query(self, ts, start, end, length, channels):
+        """
+        Resolve package, channels and time range (usecs) of a data request,
+        returns tuple (channels, start, end).
+        """
+        if isinstance(ts, basestring):
+            # assumed to be package ID
+            ts = self.session.core.get(ts)
+
+        #CHANNELS (read once)
+        ts_channels = ts.channels
+
+        #no channels specified
+        if channels is None:
+            channels = ts_channels
+        #1 channel specified as TSC object
+        elif isinstance(channels,TimeSeriesChannel):
+            channels = [channels]
+        #1 channel specified and channel id
+        elif isinstance(channels,basestring):
+            channels = [ch for ch in ts_channels if ch.id==channels]
+        #list of channel ids OR ts channels
+        else:
+            all_ch = []
+            for chan in channels:
+                if isinstance(chan,basestring):
+                    all_ch.extend([ch for ch in ts_channels if ch.id==chan])
+                else:
+                    all_ch.extend([ch for ch in ts_channels if ch==chan])
+            channels = all_ch
+
+        # determine start (usecs)
+        the_start = min(ch.start for ch in ts_channels) if start is None else infer_epoch(start)
+
+        # determine end
+        if length is not None:
+            if isinstance(length, basestring):
+                length_usec = parse_timedelta(length)
+            else:
+                length_usec = length
+            the_end = the_start + length_usec
+
+        elif end is not None:
+            the_end = infer_epoch(end)
+        else:
+            the_end = max(ch.end for ch in ts_channels)
+
+        # logical check
+        if the_end < the_start:
+            raise Exception("End time cannot be before start time.")
+
+        the_start = long(the_start)
+        the_end = long(the_end)
+        return channels, the_start, the_end
+
 
     def _annotation_query_params(ts, start, end, period, layer, channels):
         # parse channel input
@@ -834,7 +2216,7 @@ class TimeSeriesAPI(APIBase):
 
         if channels is None:
             # if channel(s) not specified, grab all for package
-            channels = self.session.timeseries.get_channels(ts_id)
+            channels = self.session.timeseries.get_cached_channels(ts_id)
 
         # check if list
         if not hasattr(channels, '__iter__'):
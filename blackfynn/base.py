@@ -13,6 +13,16 @@ from blackfynn.utils import log
 from blackfynn.models import User
 
 
+PROTOBUF_CONTENT_TYPE = 'application/x-protobuf'
+
+
+class ProtobufContent(str):
+    """
+    Body of a response sent as ``PROTOBUF_CONTENT_TYPE`` (serialized message)
+    """
+    pass
+
+
 class UnauthorizedException(Exception):
     pass
 
@@ -34,6 +44,10 @@ class BlackfynnRequest(object):
 
         if not resp.status_code in [requests.codes.ok, requests.codes.created]:
             resp.raise_for_status()
+        if resp.headers.get('Content-Type', '').startswith(PROTOBUF_CONTENT_TYPE):
+            # binary response, decoded by caller
+            resp.data = ProtobufContent(resp.content)
+            return
         try:
             # return object from json
             resp.data = json.loads(resp.content)
@@ -48,6 +62,12 @@ class BlackfynnRequest(object):
     def result(self,*args, **kwargs):
         return self._request.result(*args, **kwargs)
 
+    def cancel(self):
+        """
+        Cancel request, if it has not started. Returns True if cancelled.
+        """
+        return self._request.cancel()
+
 
 class ClientSession(object):
     def __init__(self, api_token=None, api_secret=None, host=None, streaming_host=None):
@@ -106,8 +126,15 @@ class ClientSession(object):
         Make requests-futures work within threaded/distributed environment.
         """
         if not hasattr(self._session, 'session'):
-            self._session = FuturesSession(max_workers=4)
+            self._session = FuturesSession(max_workers=settings.max_request_workers)
             self._set_auth(self._token)
+            # dedicated connection pool for streaming (timeseries data) requests,
+            # sized so that every worker can keep its connection alive
+            if self._streaming_host is not None:
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections = 1,
+                    pool_maxsize     = settings.max_request_workers)
+                self._session.mount(self._streaming_host, adapter)
 
         return self._session
 
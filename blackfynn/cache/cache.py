@@ -1,9 +1,10 @@
 import os
 import time
+import errno
 import sqlite3
 import platform
+import threading
 import numpy as np
-import pandas as pd
 from glob import glob
 import multiprocessing as mp
 from itertools import groupby
@@ -15,92 +16,178 @@ from blackfynn.utils import usecs_to_datetime, usecs_since_epoch, log
 from blackfynn.models import DataPackage, TimeSeriesChannel
 from .cache_segment_pb2 import CacheSegment
 
+# page status, see ``Cache.page_status``
+PAGE_MISSING = 0
+PAGE_EMPTY   = 1
+PAGE_PRESENT = 2
+
+# bytes per cached sample (int64 time, float64 value)
+SAMPLE_BYTES = 16
+
+# index DB lock handling: busy timeout (seconds) and retries of failed compaction
+INDEX_TIMEOUT     = 10
+INDEX_RETRIES     = 5
+INDEX_RETRY_WAIT  = 0.1 # seconds, doubled for every retry
+
+def adaptive_page_size(rate):
+    """
+    Returns page size (samples) for a channel sampled at ``rate`` (Hz), targeting
+    ``ts_page_bytes`` bytes per page, with pages spanning at most
+    ``ts_page_max_duration`` seconds.
+    """
+    size = settings.ts_page_bytes // SAMPLE_BYTES
+    return max(1, int(min(size, rate*settings.ts_page_max_duration)))
+
 def filter_id(some_id):
     return some_id.replace(':','_').replace('-','_')
 
-def remove_old_pages(cache, mbdiff):
-    # taste the rainbow!
-    n = int(1.5 * ((mbdiff * 1024*1024) / 100) / cache.page_size) + 5
-
-    # 2. Delete some pages from cache
+def make_dirs(path):
+    """
+    Create directory ``path`` (and parents), unless it exists. Safe when
+    another thread or process creates it at the same time.
+    """
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+def remove_old_pages(cache, nbytes):
+    """
+    Remove the oldest/least accessed pages (and event blocks) from the cache,
+    totalling at least ``nbytes`` bytes. Returns number of bytes removed.
+    """
+    pages, blocks, removed = [], [], 0
     with cache.index_con as con:
-        log.debug("Cache - removing {} pages...".format(n))
         # find the oldest/least accessed pages
         q = """
-            SELECT channel,page,access_count,last_access
-            FROM ts_pages
+            SELECT 0, channel, page, COALESCE(bytes, 0), access_count, last_access
+            FROM   ts_pages
+            UNION ALL
+            SELECT 1, channel, start, bytes, access_count, last_access
+            FROM   ts_event_blocks
             ORDER BY last_access ASC, access_count ASC
-            LIMIT {num_pages}
-        """.format(num_pages=n)
-        pages = con.execute(q).fetchall()
+        """
+        for is_block, channel, key, size, _, _ in con.execute(q):
+            if removed >= nbytes:
+                break
+            (blocks if is_block else pages).append((channel, key))
+            removed += size
+    log.debug("Cache - removing {} pages...".format(len(pages) + len(blocks)))
 
     # remove the selected pages
-    pages_by_channel = groupby(pages, lambda x: x[0])
-    for channel, page_group in pages_by_channel:
-        _,pages,counts,times = zip(*page_group)
-        # remove page files
-        cache.remove_pages(channel, *pages)
+    for channel, page_group in groupby(sorted(pages), lambda x: x[0]):
+        cache.remove_pages(channel, *[page for _, page in page_group])
+    for channel, block_group in groupby(sorted(blocks), lambda x: x[0]):
+        cache.remove_event_blocks(channel, *[start for _, start in block_group])
 
     with cache.index_con as con:
         con.execute("VACUUM")
 
-    log.debug('Cache - {} pages removed.'.format(n))
-    return n
+    log.debug('Cache - {} bytes removed.'.format(removed))
+    return removed
 
 
 def compact_cache():
     cache = get_cache()
     log.debug('Inspecting cache...')
-    wait = 2
+    retries = 0
     max_mb = settings.cache_max_size
     current_mb = (cache.size/(1024.0*1024))
     desired_mb = 0.9*max_mb 
     while current_mb > desired_mb:
         log.debug('Cache - current: {:02f} MB, maximum: {} MB'.format(current_mb, max_mb))
         try:
-            remove_old_pages(cache, current_mb-desired_mb)
+            if not remove_old_pages(cache, long((current_mb-desired_mb)*1024*1024)):
+                # nothing left to remove
+                return
         except sqlite3.OperationalError:
-            log.debug('Cache - Index DB was locked, waiting {} seconds...'.format(wait))
-            if wait >= 1024:
-                log.error('Cache - Unable to compact cache!')
+            if retries >= INDEX_RETRIES:
+                # next inspection will try again
+                log.warn('Cache - Index DB is busy, unable to compact cache.')
                 return # silently fail
+            wait = INDEX_RETRY_WAIT * 2**retries
+            log.debug('Cache - Index DB was locked, waiting {} seconds...'.format(wait))
             time.sleep(wait)
-            wait = wait*2
+            retries += 1
         current_mb = (cache.size/(1024.0*1024))
 
 
-def create_segment(channel, series):
+def create_segment(channel, times, values):
     segment = CacheSegment()
     segment.channelId = channel.id
-    segment.index = series.index.astype(np.int64).values.tobytes()
-    segment.data = series.values.tobytes()
+    segment.index = np.asarray(times, dtype=np.int64).tobytes()
+    segment.data = np.asarray(values, dtype=np.double).tobytes()
     return segment
 
 
-def read_segment(channel, bytes):
+def find_segments(times, rate):
+    """
+    Returns list of contiguous (start, end) ranges of sample times (usecs),
+    where end is one sample period past the last sample of the range.
+    """
+    if not len(times):
+        return []
+    period = 1.0e6/rate
+    # same gap criterion as used when streaming data
+    breaks = np.where(np.diff(times) > 1.75*period)[0]
+    starts = np.hstack((times[:1], times[breaks+1]))
+    ends   = np.hstack((times[breaks], times[-1:])) + long(round(period))
+    return zip(starts.tolist(), ends.tolist())
+
+
+def read_segment_arrays(bytes):
+    """
+    Returns (index, data) arrays of serialized segment, without copying.
+    Index values are nanoseconds since Epoch.
+    """
     segment = CacheSegment.FromString(bytes)
-    index = pd.to_datetime(np.fromstring(segment.index, np.int64))
-    data  = np.fromstring(segment.data, np.double)
-    series = pd.Series(data=data, index=index, name=channel.name)
-    return series
+    index = np.frombuffer(segment.index, np.int64)
+    data  = np.frombuffer(segment.data, np.double)
+    return index, data
 
 
 class Cache(object):
     def __init__(self):
-        self._conn         = None
+        self._local        = threading.local()
         self.dir           = settings.cache_dir
         self.index_loc     = settings.cache_index
         self.write_counter = 0
 
         # this might be replaced with existing page size (from DB)
         self.page_size = settings.ts_page_size
+        # page size per channel, see ``channel_page_size``
+        self._channel_page_sizes = {}
+
+        # buffered access statistics, see ``flush_access``
+        self._access_lock  = threading.Lock()
+        self._page_access  = {}
+        self._event_access = {}
+        self._last_flush   = time.time()
 
         self.init_dir()
 
+    @property
+    def _conn(self):
+        # sqlite connections can't be shared between threads, or with forked
+        # processes (the parent's connection is left alone)
+        conn, pid = getattr(self._local, 'conn', (None, None))
+        return conn if pid == os.getpid() else None
+
+    @_conn.setter
+    def _conn(self, conn):
+        self._local.conn = (conn, os.getpid())
+
     @property
     def index_con(self):
         if self._conn is None:
-            self._conn = sqlite3.connect(self.index_loc, timeout=60)
+            con = sqlite3.connect(self.index_loc, timeout=INDEX_TIMEOUT)
+            # write-ahead log: readers don't block (and aren't blocked by) the writer
+            mode = con.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+            if mode.lower() != 'wal':
+                log.debug('Cache - Index DB journal mode is {}'.format(mode))
+            con.execute('PRAGMA synchronous=NORMAL')
+            self._conn = con
         return self._conn
 
     def init_dir(self):
@@ -115,6 +202,10 @@ class Cache(object):
     def init_tables(self):
         with self.index_con as con:
             self.init_index_table(con)
+            self.init_empty_pages_table(con)
+            self.init_segments_table(con)
+            self.init_channels_table(con)
+            self.init_event_blocks_table(con)
             self.init_settings_table(con)
 
     def init_index_table(self, con):
@@ -131,9 +222,104 @@ class Cache(object):
                     access_count INTEGER NOT NULL,
                     last_access DATETIME NOT NULL,
                     has_data BOOLEAN,
+                    bytes INTEGER,
                     PRIMARY KEY (channel, page))
             """
             con.execute(q)
+        else:
+            # check for bytes field (not there indicating old cache)
+            fields = zip(*con.execute("PRAGMA table_info('ts_pages');").fetchall())[1]
+            if 'bytes' not in fields:
+                log.info('Cache - Recording page sizes in \'ts_pages\' table')
+                con.execute("ALTER TABLE ts_pages ADD COLUMN bytes INTEGER")
+                pages = con.execute("SELECT channel, page FROM ts_pages WHERE has_data").fetchall()
+                sizes = []
+                for channel_id, page in pages:
+                    filename = self.page_file(channel_id, page)
+                    if os.path.exists(filename):
+                        sizes.append((os.stat(filename).st_size, channel_id, page))
+                q = "UPDATE ts_pages SET bytes=? WHERE channel=? AND page=?"
+                con.executemany(q, sizes)
+
+    def init_empty_pages_table(self, con):
+        # check for empty pages table
+        q = "SELECT name FROM sqlite_master WHERE type='table' AND name='ts_empty_pages'"
+        r = con.execute(q)
+        if r.fetchone() is None:
+            log.info('Cache - Creating \'ts_empty_pages\' table')
+            # coalesced ranges [start, end) of pages known to be empty
+            q = """
+                CREATE TABLE ts_empty_pages (
+                    channel CHAR(50) NOT NULL,
+                    start INTEGER NOT NULL,
+                    end INTEGER NOT NULL,
+                    PRIMARY KEY (channel, start))
+            """
+            con.execute(q)
+
+    def init_segments_table(self, con):
+        # check for segments table
+        q = "SELECT name FROM sqlite_master WHERE type='table' AND name='ts_segments'"
+        r = con.execute(q)
+        if r.fetchone() is None:
+            log.info('Cache - Creating \'ts_segments\' table')
+            # contiguous ranges of channel data (usecs), learned from fetched pages
+            q = """
+                CREATE TABLE ts_segments (
+                    channel CHAR(50) NOT NULL,
+                    start INTEGER NOT NULL,
+                    end INTEGER NOT NULL,
+                    PRIMARY KEY (channel, start))
+            """
+            con.execute(q)
+
+    def init_channels_table(self, con):
+        # check for channels table
+        q = "SELECT name FROM sqlite_master WHERE type='table' AND name='ts_channels'"
+        r = con.execute(q)
+        if r.fetchone() is None:
+            log.info('Cache - Creating \'ts_channels\' table')
+            # page size (samples) used for each channel
+            q = """
+                CREATE TABLE ts_channels (
+                    channel CHAR(50) NOT NULL,
+                    page_size INTEGER NOT NULL,
+                    PRIMARY KEY (channel))
+            """
+            con.execute(q)
+
+    def init_event_blocks_table(self, con):
+        # check for event blocks table
+        q = "SELECT name FROM sqlite_master WHERE type='table' AND name='ts_event_blocks'"
+        r = con.execute(q)
+        if r.fetchone() is None:
+            log.info('Cache - Creating \'ts_event_blocks\' table')
+            # ranges [start, end) (usecs) of event channels, with all their events cached
+            q = """
+                CREATE TABLE ts_event_blocks (
+                    channel CHAR(50) NOT NULL,
+                    start INTEGER NOT NULL,
+                    end INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    access_count INTEGER NOT NULL,
+                    last_access DATETIME NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    PRIMARY KEY (channel, start))
+            """
+            con.execute(q)
+        else:
+            # check for bytes field (not there indicating old cache)
+            fields = zip(*con.execute("PRAGMA table_info('ts_event_blocks');").fetchall())[1]
+            if 'bytes' not in fields:
+                con.execute("ALTER TABLE ts_event_blocks ADD COLUMN bytes INTEGER NOT NULL DEFAULT 0")
+                blocks = con.execute("SELECT channel, start FROM ts_event_blocks WHERE count>0").fetchall()
+                sizes = []
+                for channel_id, start in blocks:
+                    filename = self.event_block_file(channel_id, start)
+                    if os.path.exists(filename):
+                        sizes.append((os.stat(filename).st_size, channel_id, start))
+                q = "UPDATE ts_event_blocks SET bytes=? WHERE channel=? AND start=?"
+                con.executemany(q, sizes)
 
     def init_settings_table(self, con):
         # check for settings table
@@ -147,20 +333,15 @@ class Cache(object):
                     ts_page_size INTEGER NOT NULL,
                     ts_format    CHAR(50) NOT NULL,
                     max_bytes    INTEGER NOT NULL,
-                    modified     DATETIME)
+                    modified     DATETIME,
+                    total_bytes  INTEGER NOT NULL DEFAULT 0)
             """
             con.execute(q)
 
             # insert settings values
-            q = """
-                INSERT INTO settings
-                VALUES ({page_size}, '{format}', {max_bytes},'{time}')
-            """.format(
-                page_size = self.page_size,
-                format    = 'PROTOBUF',
-                max_bytes = settings.cache_max_size,
-                time      = datetime.now().isoformat())
-            con.execute(q)
+            q = "INSERT INTO settings VALUES (?,?,?,?,?)"
+            con.execute(q, (self.page_size, 'PROTOBUF', settings.cache_max_size, datetime.now().isoformat(),
+                            self._indexed_bytes(con)))
 
         else:
             # settings table exists
@@ -173,6 +354,12 @@ class Cache(object):
                 # we switched the serialization format, we'll need to refresh it.
                 log.warn('Deprecated cache format detected - clearing & reinitializing cache...')
                 self.clear()
+                return
+
+            # running total of page bytes (not there indicating old cache)
+            if 'total_bytes' not in fields:
+                con.execute("ALTER TABLE settings ADD COLUMN total_bytes INTEGER NOT NULL DEFAULT 0")
+                con.execute("UPDATE settings SET total_bytes=?", (self._indexed_bytes(con),))
 
             # 2. check page size
             result = con.execute("SELECT ts_page_size FROM settings").fetchone()
@@ -187,104 +374,387 @@ class Cache(object):
                 self.page_size = settings.ts_page_size
 
 
-    def set_page(self, channel, page, has_data):
+    def channel_page_size(self, channel):
+        """
+        Returns page size (samples) of channel. New channels are assigned an
+        adaptive page size, channels with pages cached before page sizes were
+        assigned per channel keep using the page size of the cache.
+        """
+        size = self._channel_page_sizes.get(channel.id)
+        if size is not None:
+            return size
         with self.index_con as con:
-            q = "INSERT INTO ts_pages VALUES ('{channel}',{page},0,'{time}',{has_data})".format(
-                    channel=channel.id,
-                    page=page,
-                    time=datetime.now().isoformat(),
-                    has_data=int(has_data))
-            con.execute(q)
+            q = "SELECT page_size FROM ts_channels WHERE channel=?"
+            r = con.execute(q, (channel.id,)).fetchone()
+            if r is None:
+                q = """
+                    SELECT 1 FROM ts_pages WHERE channel=?
+                    UNION ALL
+                    SELECT 1 FROM ts_empty_pages WHERE channel=?
+                    LIMIT 1
+                """
+                if con.execute(q, (channel.id, channel.id)).fetchone() is not None:
+                    size = self.page_size
+                else:
+                    size = adaptive_page_size(channel.rate)
+                q = "INSERT OR IGNORE INTO ts_channels VALUES (?,?)"
+                con.execute(q, (channel.id, size))
+                # another process may have assigned the page size first
+                q = "SELECT page_size FROM ts_channels WHERE channel=?"
+                r = con.execute(q, (channel.id,)).fetchone()
+            size = r[0]
+        self._channel_page_sizes[channel.id] = size
+        return size
+
+    def _indexed_bytes(self, con):
+        # total bytes of pages and event blocks, according to the index
+        q = """
+            SELECT COALESCE(SUM(bytes), 0) FROM ts_pages
+            UNION ALL
+            SELECT COALESCE(SUM(bytes), 0) FROM ts_event_blocks
+        """
+        return sum(r[0] for r in con.execute(q))
+
+    def _add_bytes(self, con, nbytes):
+        # update running total of page bytes
+        if nbytes:
+            con.execute("UPDATE settings SET total_bytes = total_bytes + ?", (nbytes,))
+
+    def set_page(self, channel, page, has_data, bytes=0):
+        with self.index_con as con:
+            q = """
+                INSERT INTO ts_pages (channel, page, access_count, last_access, has_data, bytes)
+                VALUES (?,?,0,?,?,?)
+            """
+            con.execute(q, (channel.id, page, datetime.now().isoformat(), int(has_data), bytes))
+            self._add_bytes(con, bytes)
 
     def set_page_data(self, channel, page, data, update=False):
-        has_data = False if data is None else len(data)>0
+        """
+        Store page data, a tuple of (times, values) arrays (times in nanoseconds).
+        """
+        has_data = False if data is None else len(data[0])>0
+        bytes = 0
         if has_data:
             # there is data, write it to file
             filename = self.page_file(channel.id, page, make_dir=True)
-            segment = create_segment(channel=channel, series=data)
+            times, values = data
+            segment = create_segment(channel=channel, times=times, values=values).SerializeToString()
             with open(filename, 'wb') as f:
-                f.write(segment.SerializeToString())
+                f.write(segment)
+            bytes = len(segment)
             self.page_written()
         try:
-            if update:
+            if not has_data:
+                # empty pages are indexed as ranges
+                self.set_empty_page(channel, page)
+            elif update:
                 # modifying an existing page entry
-                self.update_page(channel, page, has_data)
+                self.add_segments(channel, find_segments(data[0]//1000, channel.rate))
+                self.update_page(channel, page, has_data, bytes=bytes)
             else:
                 # adding a new page entry
-                self.set_page(channel, page, has_data)
+                self.add_segments(channel, find_segments(data[0]//1000, channel.rate))
+                self.set_page(channel, page, has_data, bytes=bytes)
         except sqlite3.OperationalError:
             log.warn('Indexing DB inaccessible, resetting connection.')
             if self._conn is not None:
                 self._conn.close()
             self._conn = None
+            if has_data and os.path.exists(filename):
+                # page file isn't indexed (and wouldn't be evicted)
+                os.remove(filename)
         except sqlite3.IntegrityError:
             # page already exists - ignore
             pass
 
-    def check_page(self, channel, page):
+    def set_empty_page(self, channel, page):
         """
-        Does page exist in cache?
+        Mark page as empty, merging it with adjacent empty ranges.
         """
         with self.index_con as con:
-            q = """ SELECT page
-                    FROM   ts_pages
-                    WHERE  channel='{channel}' AND page={page}
-            """.format(channel=channel.id, page=page)
-            r = con.execute(q).fetchone()
-            return r is not None
-
-    def page_has_data(self, channel, page):
+            q = """
+                SELECT start, end
+                FROM   ts_empty_pages
+                WHERE  channel=? AND start<=? AND end>=?
+            """
+            adjacent = con.execute(q, (channel.id, page+1, page)).fetchall()
+            start = min([page]   + [r[0] for r in adjacent])
+            end   = max([page+1] + [r[1] for r in adjacent])
+            q = """
+                DELETE
+                FROM  ts_empty_pages
+                WHERE channel=? AND start>=? AND end<=?
+            """
+            con.execute(q, (channel.id, start, end))
+            q = "INSERT INTO ts_empty_pages VALUES (?,?,?)"
+            con.execute(q, (channel.id, start, end))
+            # page may have been indexed individually
+            q = "SELECT COALESCE(bytes, 0) FROM ts_pages WHERE channel=? AND page=?"
+            self._add_bytes(con, -sum(r[0] for r in con.execute(q, (channel.id, page))))
+            q = "DELETE FROM ts_pages WHERE channel=? AND page=?"
+            con.execute(q, (channel.id, page))
+
+    def page_status(self, channel, start, end):
+        """
+        Returns status of pages in range [start, end) as an array of
+        ``PAGE_MISSING``, ``PAGE_EMPTY`` or ``PAGE_PRESENT``.
+        """
+        status = np.full(max(0, end-start), PAGE_MISSING, dtype=np.int8)
         with self.index_con as con:
             q = """
-                SELECT has_data
+                SELECT page, page+1, has_data
                 FROM   ts_pages
-                WHERE  channel='{channel}' AND page={page}
-            """.format(channel=channel.id, page=page)
-            r = con.execute(q).fetchone()
-            return None if r is None else bool(r[0])
+                WHERE  channel=:channel AND page>=:start AND page<:end
+                UNION ALL
+                SELECT start, end, 0
+                FROM   ts_empty_pages
+                WHERE  channel=:channel AND end>:start AND start<:end
+            """
+            params = dict(channel=channel.id, start=start, end=end)
+            for first, last, has_data in con.execute(q, params):
+                first, last = max(first, start), min(last, end)
+                status[first-start:last-start] = PAGE_PRESENT if has_data else PAGE_EMPTY
+        return status
 
-    def get_page_data(self, channel, page):
-        has_data = self.page_has_data(channel, page) 
+    def check_page(self, channel, page):
+        """
+        Does page exist in cache?
+        """
+        return self.page_status(channel, page, page+1)[0] != PAGE_MISSING
+
+    def page_has_data(self, channel, page):
+        status = self.page_status(channel, page, page+1)[0]
+        return None if status == PAGE_MISSING else bool(status == PAGE_PRESENT)
+
+    def get_page_data(self, channel, page, has_data=None, touch=True):
+        """
+        Returns page data as (times, values) arrays, or None if not cached.
+        Access statistics of the page are updated, unless ``touch`` is False
+        (see ``touch_pages``).
+        """
+        if has_data is None:
+            has_data = self.page_has_data(channel, page)
         if has_data is None:
             # page not present in cache
             return None
         elif not has_data:
             # page is empty
-            return pd.Series([], index=pd.core.index.DatetimeIndex([]))
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.double)
 
         # page has data, let's get it
         filename = self.page_file(channel.id, page, make_dir=True)
         if os.path.exists(filename):
             # get page data from file
             with open(filename,'rb') as f:
-                series = read_segment(channel, f.read())
+                data = read_segment_arrays(f.read())
             # update access count
-            self.update_page(channel, page, has_data)
-            return series
+            if touch:
+                self.touch_pages(channel, [page])
+            return data
         else:
             # page file has been deleted recently?
             log.warn('Page file not found: {}'.format(filename))
             return None
 
-    def update_page(self, channel, page, has_data=True):
-       with self.index_con as con:
+    def add_segments(self, channel, segments):
+        """
+        Add contiguous (start, end) ranges of channel data, merging them with
+        overlapping or adjacent known segments.
+        """
+        fuzz = long(0.75*1.0e6/channel.rate)
+        with self.index_con as con:
+            for start, end in segments:
+                q = """
+                    SELECT start, end
+                    FROM   ts_segments
+                    WHERE  channel=? AND start<=? AND end>=?
+                """
+                overlapping = con.execute(q, (channel.id, end+fuzz, start-fuzz)).fetchall()
+                if overlapping:
+                    start = min([start] + [r[0] for r in overlapping])
+                    end   = max([end]   + [r[1] for r in overlapping])
+                    q = "DELETE FROM ts_segments WHERE channel=? AND start=?"
+                    con.executemany(q, [(channel.id, r[0]) for r in overlapping])
+                q = "INSERT INTO ts_segments VALUES (?,?,?)"
+                con.execute(q, (channel.id, start, end))
+
+    def get_segments(self, channel, start=None, end=None):
+        """
+        Returns known (start, end) ranges of channel data (usecs), in order.
+        """
+        with self.index_con as con:
             q = """
-                UPDATE ts_pages 
+                SELECT start, end
+                FROM   ts_segments
+                WHERE  channel=? AND end>? AND start<?
+                ORDER  BY start
+            """
+            params = (channel.id,
+                      -2**62 if start is None else start,
+                      2**62 if end is None else end)
+            return [tuple(r) for r in con.execute(q, params)]
+
+    def get_gaps(self, channel, start=None, end=None):
+        """
+        Returns (start, end) ranges between known segments of channel data,
+        where all pages spanning the range have been fetched.
+        """
+        segments = self.get_segments(channel, start, end)
+        page_delta = channel._page_delta(self.channel_page_size(channel))
+        gaps = []
+        for (_, gap_start), (gap_end, _) in zip(segments[:-1], segments[1:]):
+            status = self.page_status(channel, gap_start // page_delta, (gap_end-1) // page_delta + 1)
+            if (status != PAGE_MISSING).all():
+                gaps.append((gap_start, gap_end))
+        return gaps
+
+    def set_event_block(self, channel, start, end, times, values):
+        """
+        Store events of channel in range [start, end) (usecs), where ``times``
+        (usecs) and ``values`` are all events in the range.
+        """
+        bytes = 0
+        if len(times):
+            filename = self.event_block_file(channel.id, start, make_dir=True)
+            segment = create_segment(channel=channel, times=times, values=values).SerializeToString()
+            with open(filename, 'wb') as f:
+                f.write(segment)
+            bytes = len(segment)
+            self.page_written()
+        try:
+            with self.index_con as con:
+                q = "INSERT INTO ts_event_blocks VALUES (?,?,?,?,0,?,?)"
+                con.execute(q, (channel.id, start, end, len(times), datetime.now().isoformat(), bytes))
+                self._add_bytes(con, bytes)
+        except sqlite3.OperationalError:
+            log.warn('Indexing DB inaccessible, resetting connection.')
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = None
+            if len(times) and os.path.exists(filename):
+                # block file isn't indexed (and wouldn't be evicted)
+                os.remove(filename)
+        except sqlite3.IntegrityError:
+            # block already exists - ignore
+            pass
+
+    def get_event_blocks(self, channel, start, end):
+        """
+        Returns cached event blocks (start, end, count) of channel overlapping
+        range [start, end) (usecs), in order.
+        """
+        with self.index_con as con:
+            q = """
+                SELECT start, end, count
+                FROM   ts_event_blocks
+                WHERE  channel=? AND end>? AND start<?
+                ORDER  BY start
+            """
+            return [tuple(r) for r in con.execute(q, (channel.id, start, end))]
+
+    def get_event_block_data(self, channel, start, count):
+        """
+        Returns events of block as (times, values) arrays (times in usecs), or
+        None if the block's file has disappeared.
+        """
+        if count == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.double)
+        filename = self.event_block_file(channel.id, start)
+        if not os.path.exists(filename):
+            log.warn('Event block file not found: {}'.format(filename))
+            self.remove_event_blocks(channel.id, start)
+            return None
+        with open(filename, 'rb') as f:
+            data = read_segment_arrays(f.read())
+        self._record_access(self._event_access, channel.id, [start])
+        return data
+
+    def update_page(self, channel, page, has_data=True, bytes=None):
+        """
+        Update page entry, after its data has been (re)written with ``bytes`` bytes.
+        """
+        with self.index_con as con:
+            if bytes is not None:
+                q = "SELECT COALESCE(bytes, 0) FROM ts_pages WHERE channel=? AND page=?"
+                r = con.execute(q, (channel.id, page)).fetchone()
+                if r is None:
+                    # entry has been removed (e.g. by compaction)
+                    q = """
+                        INSERT INTO ts_pages (channel, page, access_count, last_access, has_data, bytes)
+                        VALUES (?,?,0,?,?,?)
+                    """
+                    con.execute(q, (channel.id, page, datetime.now().isoformat(), int(has_data), bytes))
+                    self._add_bytes(con, bytes)
+                    return
+                self._add_bytes(con, bytes - r[0])
+                q = "UPDATE ts_pages SET bytes=? WHERE channel=? AND page=?"
+                con.execute(q, (bytes, channel.id, page))
+            q = """
+                UPDATE ts_pages
                 SET access_count = access_count + 1,
-                    last_access  = '{now}',
-                    has_data     = {has_data}
-                WHERE channel='{channel}' AND page='{page}'
-            """.format(channel=channel.id,
-                       page=page,
-                       has_data=int(has_data),
-                       now=datetime.now().isoformat())
-            con.execute(q) 
+                    last_access  = ?,
+                    has_data     = ?
+                WHERE channel=? AND page=?
+            """
+            con.execute(q, (datetime.now().isoformat(), int(has_data), channel.id, page))
+
+    def touch_pages(self, channel, pages):
+        """
+        Record access of cached pages. Access statistics are buffered, and
+        written by ``flush_access``.
+        """
+        self._record_access(self._page_access, channel.id, pages)
+
+    def _record_access(self, buffer, channel_id, keys):
+        now = datetime.now().isoformat()
+        with self._access_lock:
+            for key in keys:
+                count, _ = buffer.get((channel_id, key), (0, None))
+                buffer[(channel_id, key)] = (count+1, now)
+            n = len(self._page_access) + len(self._event_access)
+        if n >= settings.cache_access_flush_pages or \
+                time.time() - self._last_flush >= settings.cache_access_flush_interval:
+            self.flush_access()
+
+    def flush_access(self):
+        """
+        Write buffered access statistics to the index, with a single
+        transaction.
+        """
+        with self._access_lock:
+            pages, self._page_access = self._page_access, {}
+            events, self._event_access = self._event_access, {}
+            self._last_flush = time.time()
+        if not pages and not events:
+            return
+        try:
+            with self.index_con as con:
+                q = """
+                    UPDATE ts_pages
+                    SET access_count = access_count + ?,
+                        last_access  = MAX(last_access, ?)
+                    WHERE channel=? AND page=?
+                """
+                con.executemany(q, [(n, t, ch, p) for (ch, p), (n, t) in pages.iteritems()])
+                q = """
+                    UPDATE ts_event_blocks
+                    SET access_count = access_count + ?,
+                        last_access  = MAX(last_access, ?)
+                    WHERE channel=? AND start=?
+                """
+                con.executemany(q, [(n, t, ch, b) for (ch, b), (n, t) in events.iteritems()])
+        except sqlite3.Error as e:
+            # statistics are approximate, drop them rather than fail reads
+            log.debug('Cache - unable to write access statistics: {}'.format(e))
 
     def page_written(self):
         # cache compaction?
         self.write_counter += 1
         if self.write_counter > settings.cache_inspect_interval:
             self.write_counter = 0
+            # eviction uses access statistics
+            self.flush_access()
             self.start_compaction()
 
     def start_compaction(self, async=True):
@@ -308,29 +778,53 @@ class Cache(object):
                 pass
         # remove page index entries
         with self.index_con as con:
-            q = """
-                DELETE
-                FROM ts_pages
-                WHERE channel = '{channel}' AND page in ({pages})
-            """.format(channel=channel_id, pages=','.join(map(str, pages)))
-            con.execute(q)
+            q = "SELECT COALESCE(bytes, 0) FROM ts_pages WHERE channel=? AND page=?"
+            self._add_bytes(con, -sum(r[0] for page in pages for r in con.execute(q, (channel_id, page))))
+            q = "DELETE FROM ts_pages WHERE channel=? AND page=?"
+            con.executemany(q, [(channel_id, page) for page in pages])
+
+    def remove_event_blocks(self, channel_id, *starts):
+        # remove event block files
+        for start in starts:
+            filename = self.event_block_file(channel_id, start)
+            if os.path.exists(filename):
+                os.remove(filename)
+        # remove event block index entries
+        with self.index_con as con:
+            q = "SELECT bytes FROM ts_event_blocks WHERE channel=? AND start=?"
+            self._add_bytes(con, -sum(r[0] for start in starts for r in con.execute(q, (channel_id, start))))
+            q = "DELETE FROM ts_event_blocks WHERE channel=? AND start=?"
+            con.executemany(q, [(channel_id, start) for start in starts])
 
     def page_file(self, channel_id, page, make_dir=False):
         """
         Return the file corresponding to a timeseries page (stored as serialized protobuf).
         """
         filedir = os.path.join(self.dir, filter_id(channel_id))
-        if make_dir and not os.path.exists(filedir):
-            os.makedirs(filedir)
+        if make_dir:
+            make_dirs(filedir)
         filename = os.path.join(filedir,'page-{}.bin'.format(page))
         return filename
 
+    def event_block_file(self, channel_id, start, make_dir=False):
+        """
+        Return the file corresponding to an event block (stored as serialized protobuf).
+        """
+        filedir = os.path.join(self.dir, filter_id(channel_id))
+        if make_dir:
+            make_dirs(filedir)
+        return os.path.join(filedir,'events-{}.bin'.format(start))
+
     def clear(self):
         import shutil
         if self._conn is not None:
             with self.index_con as con:
                 # remove page entries
                 con.execute('DELETE FROM ts_pages;')
+                con.execute('DELETE FROM ts_empty_pages;')
+                con.execute('DELETE FROM ts_segments;')
+                con.execute('DELETE FROM ts_channels;')
+                con.execute('DELETE FROM ts_event_blocks;')
                 con.commit()
             self._conn.close()
             self._conn = None
@@ -339,7 +833,15 @@ class Cache(object):
             os.remove(self.index_loc)
         except:
             log.warn('Could not delete index file: {}'.format(self.index_loc))
+        for suffix in ('-wal', '-shm'):
+            # write-ahead log files (normally removed with the last connection)
+            if os.path.exists(self.index_loc + suffix):
+                os.remove(self.index_loc + suffix)
         shutil.rmtree(self.dir, ignore_errors=True)
+        self._channel_page_sizes = {}
+        with self._access_lock:
+            self._page_access  = {}
+            self._event_access = {}
         # reset
         self.init_dir()
         self.init_tables()
@@ -351,16 +853,19 @@ class Cache(object):
     @property
     def size(self):
         """
-        Returns the size of the cache in bytes
+        Returns the size of the cache in bytes, from the running total of
+        page bytes kept in the index.
         """
-        all_files = self.page_files + [self.index_loc]
-        return sum(map(lambda x: os.stat(x).st_size, all_files))
+        with self.index_con as con:
+            r = con.execute("SELECT total_bytes FROM settings").fetchone()
+        return (0 if r is None else r[0]) + os.stat(self.index_loc).st_size
 
 def get_cache(start_compaction=False, init=True):
     cache = Cache() 
+    if init:
+        # create tables before any compaction process can race us to it
+        cache.init_tables()
     if start_compaction:
         async = platform.system().lower() != 'windows'
         cache.start_compaction(async=async)
-    if init:
-        cache.init_tables()
     return cache
@@ -265,6 +265,36 @@ class Blackfynn(object):
         """
         r = self._api.data.move(destination, *things)
 
+    def get_data_many(self, packages, start=None, end=None, length=None, channel_names=None,
+                      use_cache=settings.use_cache, output='pandas'):
+        """
+        Retrieve the same time window from many timeseries packages.
+
+        Args:
+            packages (list): ``TimeSeries`` objects or package IDs
+            start (optional): start of window. Strings/timedeltas (e.g. ``'10m'``) are
+                relative to the start of each package, otherwise absolute (usecs or datetime).
+                Defaults to the start of each package.
+            end (optional): end of window, same format as ``start``
+            length (optional): length of window, e.g. ``'10m'``
+            channel_names (list, optional): names of channels to retrieve (default: all)
+            use_cache (bool, optional): use page cache
+            output (str, optional): ``'pandas'`` or ``'numpy'``, see ``TimeSeries.get_data``
+
+        Returns:
+            Generator of ``(package, data)`` tuples, as each package completes.
+
+        Example::
+
+            # first 10 minutes of every package
+            for ts, df in bf.get_data_many(packages, length='10m', channel_names=['Fp1','Fp2']):
+                print ts.name, len(df)
+
+        """
+        return self._api.timeseries.get_ts_data_many(packages, start=start, end=end, length=length,
+                                                     channel_names=channel_names, use_cache=use_cache,
+                                                     output=output)
+
     def search(self, query, max_results=10):
         """
         Find an object on the platform. 
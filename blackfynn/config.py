@@ -59,6 +59,7 @@ class Settings(object):
             # all requests
             'max_request_time'            : 120, # two minutes
             'max_request_timeout_retries' : 2,
+            'max_request_workers'         : 8,
             
             #io
             'max_upload_workers'          : 10,
@@ -77,7 +78,17 @@ class Settings(object):
             'cache_index'                 : os.path.join(self.cache_dir, 'index.db'),
             'cache_max_size'              : 2048,
             'cache_inspect_interval'      : 1000,
+            'cache_access_flush_interval' : 10, # seconds
+            'cache_access_flush_pages'    : 1000,
             'ts_page_size'                : 3600,
+            'ts_page_bytes'               : 1048576,
+            'ts_page_max_duration'        : 3600, # seconds
+            'ts_max_request_bytes'        : 8388608,
+            'ts_event_page_size'          : 10000, # events
+            'ts_prefetch_pages'           : 8,
+            'ts_max_pending_pages'        : 32,
+            'ts_binary_transfer'          : True,
+            'ts_channel_cache_ttl'        : 60, # seconds
             'use_cache'                   : True,
         }
 
@@ -146,7 +157,18 @@ class Settings(object):
             
             'cache_max_size'         : ('BLACKFYNN_CACHE_MAX_SIZE', int),
             'cache_inspect_interval' : ('BLACKFYNN_CACHE_INSPECT_EVERY', int),
+            'cache_access_flush_interval' : ('BLACKFYNN_CACHE_ACCESS_FLUSH_INTERVAL', float),
+            'cache_access_flush_pages'    : ('BLACKFYNN_CACHE_ACCESS_FLUSH_PAGES', int),
             'ts_page_size'           : ('BLACKFYNN_TS_PAGE_SIZE', int),
+            'ts_page_bytes'          : ('BLACKFYNN_TS_PAGE_BYTES', int),
+            'ts_page_max_duration'   : ('BLACKFYNN_TS_PAGE_MAX_DURATION', int),
+            'ts_max_request_bytes'   : ('BLACKFYNN_TS_MAX_REQUEST_BYTES', int),
+            'ts_event_page_size'     : ('BLACKFYNN_TS_EVENT_PAGE_SIZE', int),
+            'ts_prefetch_pages'      : ('BLACKFYNN_TS_PREFETCH_PAGES', int),
+            'ts_max_pending_pages'   : ('BLACKFYNN_TS_MAX_PENDING_PAGES', int),
+            'ts_binary_transfer'     : ('BLACKFYNN_TS_BINARY_TRANSFER', lambda x: bool(int(x))),
+            'ts_channel_cache_ttl'   : ('BLACKFYNN_TS_CHANNEL_CACHE_TTL', int),
+            'max_request_workers'    : ('BLACKFYNN_MAX_REQUEST_WORKERS', int),
             'use_cache'              : ('BLACKFYNN_USE_CACHE', lambda x: bool(int(x))),
             'log_level'              : ('BLACKFYNN_LOG_LEVEL', str),
             'default_profile'        : ('BLACKFYNN_PROFILE', str),
@@ -962,23 +962,20 @@ class TimeSeries(DataPackage):
         Returns list of Channel objects associated with package.
 
         Note:
-            This is a dynamically generated property, so every call will make an API request.
-
-            Suggested usage::
-
-                channels = ts.channels
-                for ch in channels:
-                    print ch
-            
-            This will be much slower, as the API request is being made each time.::
-
-                for ch in ts.channels:
-                    print ch
+            Channel metadata is cached for ``ts_channel_cache_ttl`` seconds (default 60,
+            ``0`` disables caching). The cache is cleared when channels are added, removed
+            or updated through the client, or data is streamed to the package; use
+            ``refresh_channels()`` to pick up changes made elsewhere.
 
         """
         self._check_exists()
-        # always dynamically return channel list
-        return self._api.timeseries.get_channels(self)
+        return self._api.timeseries.get_cached_channels(self)
+
+    def refresh_channels(self):
+        """
+        Clear cached channel metadata; the next access of ``channels`` will make an API request.
+        """
+        self._api.timeseries.invalidate_channels(self)
 
     def get_channel(self, channel):
         """
@@ -1019,7 +1016,8 @@ class TimeSeries(DataPackage):
     # ~~~~~~~~~~~~~~~~~~
     # Data 
     # ~~~~~~~~~~~~~~~~~~
-    def get_data(self, start=None, end=None, length=None, channels=None, use_cache=settings.use_cache):
+    def get_data(self, start=None, end=None, length=None, channels=None, use_cache=settings.use_cache, output='pandas',
+                 align=None, rate=None, max_points=None, decimate='minmax', timeout=None):
         """
         Get timeseries data between ``start`` and ``end`` or ``start`` and ``start + length`` 
         on specified channels (default all channels).
@@ -1029,6 +1027,21 @@ class TimeSeries(DataPackage):
             end (optional): end time of data (usecs or datetime object)
             length (optional): length of data to retrieve, e.g. '1s', '5s', '10m', '1h'
             channels (optional): list of channel objects or IDs, default all channels.
+            output (optional): ``'pandas'`` (default) for a DataFrame, or ``'numpy'`` for
+                a tuple ``(data, times)`` of a (channels x samples) array and sample
+                times in usecs since Epoch. Rows follow the order of ``channels``.
+            align (optional): how channels with different sample times are combined:
+                ``None`` (default) joins on the union of sample times, ``'native'`` returns a
+                dict of per-channel data (``(values, times)`` tuples with ``output='numpy'``),
+                ``'rate'`` a dict of data per sampling rate, and
+                ``'nearest'``/``'linear'`` resample all channels to a common ``rate``.
+            rate (optional): target rate (Hz) for ``'nearest'``/``'linear'`` alignment,
+                default is the highest channel rate.
+            max_points (optional): maximum number of samples per channel. Data is reduced
+                page by page as it is retrieved, e.g. for visualization over long ranges.
+            decimate (optional): reduction used with ``max_points``, ``'minmax'`` (default)
+                keeps the min/max envelope, ``'lttb'`` uses largest-triangle-three-buckets.
+            timeout (optional): maximum time (seconds) for retrieval, after which it fails.
 
         Note:
             Data requests will be automatically chunked and combined into a single Pandas
@@ -1051,11 +1064,111 @@ class TimeSeries(DataPackage):
 
                 data = ts.get_data(length='10s', channels=ts.channels[:2])
 
+            Get first 10 seconds as NumPy arrays::
+
+                data, times = ts.get_data(length='10s', output='numpy')
+
+            Get first hour of mixed-rate channels, resampled to 1 Hz::
+
+                data = ts.get_data(length='1h', align='nearest', rate=1)
+
+            Get an envelope of at most 2000 points per channel over a day::
+
+                data = ts.get_data(length='24h', max_points=2000)
+
+        """
+        self._check_exists()
+        if max_points is not None:
+            return self._api.timeseries.get_ts_data_decimated(self, start=start, end=end, length=length, channels=channels,
+                                                              use_cache=use_cache, max_points=max_points, method=decimate, output=output,
+                                                              timeout=timeout)
+        return self._api.timeseries.get_ts_data(self,start=start, end=end, length=length, channels=channels, use_cache=use_cache, output=output,
+                                                align=align, rate=rate, timeout=timeout)
+
+    def get_windows(self, windows, channels=None, rate=None, use_cache=settings.use_cache, timeout=None):
+        """
+        Get data for many (possibly overlapping) time windows, e.g. epochs around annotations.
+        Pages are retrieved once, even if they are needed by several windows.
+
+        Args:
+            windows: list of ``(start, end)`` tuples (usecs or datetime objects)
+            channels (optional): list of channel objects or IDs, default all channels.
+            rate (optional): sampling rate (Hz) of the result, default is the highest channel rate.
+            use_cache (optional): whether to use locally cached data
+            timeout (optional): maximum time (seconds) for retrieval, after which it fails.
+
+        Returns:
+            A (windows x channels x samples) NumPy array. Sample ``k`` of window ``i`` is
+            the sample nearest to ``start_i + k/rate``; missing samples (and samples
+            past the end of shorter windows) are NaN.
+
+        Example::
+
+            # 2 second epochs following each annotation
+            epochs = [(a.start, a.start + 2e6) for a in layer.annotations()]
+            data = ts.get_windows(epochs)
+
+        """
+        self._check_exists()
+        return self._api.timeseries.get_ts_windows(self, windows, channels=channels, use_cache=use_cache,
+                                                   rate=rate, timeout=timeout)
+
+    def aggregate(self, stats=('mean',), window='1s', channels=None, start=None, end=None, length=None,
+                  use_cache=settings.use_cache, timeout=None):
+        """
+        Get per-window statistics of channel data, computed while the data is retrieved
+        (without holding the whole range in memory).
+
+        Args:
+            stats (optional): statistics, any of ``'count'``, ``'mean'`` (default), ``'std'``,
+                              ``'rms'``, ``'min'``, ``'max'`` and ``'line_length'``
+            window (optional): window length, e.g. '1s' (default), '1m' or number of usecs
+            channels (optional): list of channel objects or IDs, default all channels.
+            start (optional): start time of data (usecs or datetime object)
+            end (optional): end time of data (usecs or datetime object)
+            length (optional): length of data to aggregate, e.g. '1s', '5s', '10m', '1h'
+            use_cache (optional): whether to use locally cached data
+            timeout (optional): maximum time (seconds) for retrieval, after which it fails.
+
+        Returns:
+            Pandas DataFrame indexed by window start, with a column for each
+            ``(channel name, statistic)``. Windows without samples are NaN (with a
+            count of 0).
+
+        Example::
+
+            # per-second mean and RMS of a day of data
+            stats = ts.aggregate(['mean', 'rms'], window='1s', length='24h')
+
+        """
+        self._check_exists()
+        return self._api.timeseries.get_ts_aggregate(self, stats=stats, window=window, start=start, end=end,
+                                                     length=length, channels=channels, use_cache=use_cache,
+                                                     timeout=timeout)
+
+    def get_data_async(self, start=None, end=None, length=None, channels=None, use_cache=settings.use_cache, **kwargs):
+        """
+        Same as ``get_data``, but returns immediately with a ``concurrent.futures.Future``
+        for the result. Accepts the same arguments as ``get_data``.
+
+        Note:
+            Retrieval runs in a background thread, but doesn't add request concurrency:
+            page requests in flight (for all retrievals together) are limited by the
+            ``max_request_workers`` setting (default 8).
+
+        Example::
+
+            future = ts.get_data_async(length='1h')
+            # ... do other work ...
+            data = future.result()
+
         """
         self._check_exists()
-        return self._api.timeseries.get_ts_data(self,start=start, end=end, length=length, channels=channels, use_cache=use_cache)
+        return self._api.timeseries.get_ts_data_async(self, start=start, end=end, length=length, channels=channels,
+                                                      use_cache=use_cache, **kwargs)
 
-    def get_data_iter(self, channels=None, start=None, end=None, length=None, chunk_size=None, use_cache=settings.use_cache):
+    def get_data_iter(self, channels=None, start=None, end=None, length=None, chunk_size=None, use_cache=settings.use_cache, output='pandas',
+                      align=None, rate=None, timeout=None):
         """
         Returns iterator over the data. Must specify **either ``end`` OR ``length``**, not both.
 
@@ -1065,13 +1178,62 @@ class TimeSeries(DataPackage):
             end: end time of data (default: latest time avialable).
             length: some time length, e.g. '1s', '5m', '1h' or number of usecs
             chunk: some time length, e.g. '1s', '5m', '1h' or number of usecs
+            output (optional): ``'pandas'`` (default) or ``'numpy'``, see ``get_data``
+            align (optional): channel alignment mode, see ``get_data``
+            rate (optional): target rate (Hz) for resampled alignment, see ``get_data``
+            timeout (optional): maximum time (seconds) for retrieval, after which iteration fails.
 
         Returns:
             iterator of Pandas Series, each the size of ``chunk_size``.
 
+        Note:
+            Close the iterator (or use it in a ``with`` block) when stopping early, to
+            cancel pending page requests::
+
+                with ts.get_data_iter(chunk_size='1m') as chunks:
+                    for chunk in chunks:
+                        if found_event(chunk):
+                            break
+
+        """
+        self._check_exists()
+        return self._api.timeseries.get_ts_data_iter(self, channels=channels, start=start, end=end, length=length, chunk_size=chunk_size, use_cache = use_cache, output=output,
+                                                     align=align, rate=rate, timeout=timeout)
+
+    def export(self, path, start=None, end=None, length=None, channels=None, format='npy', use_cache=False,
+               timeout=None):
+        """
+        Export data to a file on disk, without holding more than a few pages in memory.
+
+        Data is written as a (channels x samples) float64 array, with each channel
+        on its own sampling grid from ``start`` (missing samples are NaN). A JSON
+        sidecar ``<path>.json`` records channel names, IDs, rates, sample counts
+        and start times. Use ``blackfynn.api.timeseries.open_export`` to open an
+        export as a memory-mapped array.
+
+        Args:
+            path: destination file
+            start (optional): start time of data (usecs or datetime object)
+            end (optional): end time of data (usecs or datetime object)
+            length (optional): length of data to export, e.g. '1s', '5m', '1h'
+            channels (optional): list of channel objects or IDs, default all channels.
+            format (optional): ``'npy'`` (default), ``'hdf5'`` (requires h5py) or
+                ``'raw'`` (headerless little-endian float64)
+            use_cache (optional): whether to use (and fill) the local page cache.
+                Off by default, as large exports would evict other cached data.
+            timeout (optional): maximum time (seconds) for the export, after which it fails.
+
+        Returns:
+            The export metadata (as written to the sidecar file).
+
+        Example::
+
+            ts.export('eeg.npy', length='48h')
         """
         self._check_exists()
-        return self._api.timeseries.get_ts_data_iter(self, channels=channels, start=start, end=end, length=length, chunk_size=chunk_size, use_cache = use_cache)
+        return self._api.timeseries.export_ts_data(self, path, start=start, end=end, length=length,
+                                                   channels=channels, format=format, use_cache=use_cache,
+                                                   timeout=timeout)
 
     def write_annotation_file(self,file,layer_names = None):
         """
@@ -1299,18 +1461,27 @@ class TimeSeriesChannel(BaseDataNode):
 
     @property
     def segments(self):
-        # TODO: query API to get segments
-        raise NotImplementedError
+        """
+        List of contiguous ranges ``(start, end)`` of channel data (usecs since Epoch).
+
+        Note:
+            Segments are learned from data retrieved with ``use_cache=True``, so only
+            ranges that have been retrieved before are included.
+        """
+        return self._api.timeseries.get_segments(self)
 
     @property
     def gaps(self):
-        # TODO: infer gaps from segments
-        raise NotImplementedError
+        """
+        List of ranges ``(start, end)`` between segments known to contain no data
+        (usecs since Epoch). See ``segments``.
+        """
+        return self._api.timeseries.get_gaps(self)
 
     def update_properties(self):
         self._api.timeseries.update_channel_properties(self)
 
-    def get_data(self, start=None, end=None, length=None, use_cache=settings.use_cache):
+    def get_data(self, start=None, end=None, length=None, use_cache=settings.use_cache, output='pandas'):
         """
         Get channel data between ``start`` and ``end`` or ``start`` and ``start + length`` 
 
@@ -1319,6 +1490,9 @@ class TimeSeriesChannel(BaseDataNode):
             end       (optional): end time of data (usecs or datetime object)
             length    (optional): length of data to retrieve, e.g. '1s', '5s', '10m', '1h'
             use_cache (optional): whether to use locally cached data
+            output    (optional): ``'pandas'`` (default), or ``'numpy'`` for a tuple
+                                  ``(data, times)`` of a (1 x samples) array and sample
+                                  times in usecs since Epoch
 
         Returns:
             Pandas Series containing requested data for channel.
@@ -1347,9 +1521,10 @@ class TimeSeriesChannel(BaseDataNode):
                 end        = end,
                 length     = length,
                 channels   = [self],
-                use_cache  = use_cache)
+                use_cache  = use_cache,
+                output     = output)
 
-    def get_data_iter(self, start=None, end=None, length=None, chunk_size=None, use_cache=settings.use_cache):
+    def get_data_iter(self, start=None, end=None, length=None, chunk_size=None, use_cache=settings.use_cache, output='pandas'):
         """
         Returns iterator over the data. Must specify **either ``end`` OR ``length``**, not both.
 
@@ -1359,6 +1534,7 @@ class TimeSeriesChannel(BaseDataNode):
             length     (optional): some time length, e.g. '1s', '5m', '1h' or number of usecs
             chunk_size (optional): some time length, e.g. '1s', '5m', '1h' or number of usecs
             use_cache  (optional): whether to use locally cached data
+            output     (optional): ``'pandas'`` (default) or ``'numpy'``, see ``get_data``
 
         Returns:
             Iterator of Pandas Series, each the size of ``chunk_size``.
@@ -1371,7 +1547,38 @@ class TimeSeriesChannel(BaseDataNode):
                 length     = length,
                 channels   = [self],
                 chunk_size = chunk_size,
-                use_cache  = use_cache)
+                use_cache  = use_cache,
+                output     = output)
+
+    def get_events(self, start=None, end=None, length=None, use_cache=settings.use_cache, values=False):
+        """
+        Get event times of an event (e.g. spike) channel between ``start`` and ``end``
+        or ``start`` and ``start + length``.
+
+        Args:
+            start     (optional): start time of events (usecs or datetime object)
+            end       (optional): end time of events (usecs or datetime object)
+            length    (optional): length of range, e.g. '1s', '5s', '10m', '1h'
+            use_cache (optional): whether to use locally cached events
+            values    (optional): also return event values
+
+        Returns:
+            Array of event times (int64 usecs since Epoch), or tuple ``(times, values)``
+            when ``values`` is set.
+
+        Example:
+
+            Get spike times of the first hour::
+
+                spikes = channel.get_events(length='1h')
+        """
+        return self._api.timeseries.get_ts_events(
+                channel   = self,
+                start     = start,
+                end       = end,
+                length    = length,
+                use_cache = use_cache,
+                values    = values)
 
     def as_dict(self):
         return {
@@ -187,3 +187,6 @@ class TimeSeriesStream():
             data = series[starti:endi+1]
             # send contiguous region of data
             self._send_contiguous(channel=channel, data=data, period=period)
+
+        # channel start/end have changed
+        self.ts.refresh_channels()
@@ -4,11 +4,11 @@ import uuid
 
 from blackfynn import Blackfynn
 
-SUPERADMIN_SECRET = os.environ['SUPERADMIN_SECRET']
-SUPERADMIN_TOKEN = os.environ['SUPERADMIN_TOKEN']
+SUPERADMIN_SECRET = os.environ.get('SUPERADMIN_SECRET')
+SUPERADMIN_TOKEN = os.environ.get('SUPERADMIN_TOKEN')
 
-TESTUSER_SECRET = os.environ['TESTUSER_SECRET']
-TESTUSER_TOKEN = os.environ['TESTUSER_TOKEN']
+TESTUSER_SECRET = os.environ.get('TESTUSER_SECRET')
+TESTUSER_TOKEN = os.environ.get('TESTUSER_TOKEN')
 
 
 def pytest_addoption(parser):
@@ -19,7 +19,8 @@ def pytest_generate_tests(metafunc):
     use_dev = False
     if 'devserver' in metafunc.fixturenames:
         use_dev = metafunc.config.option.devserver
-    metafunc.parametrize("use_dev", [use_dev], scope='session')
+    if 'use_dev' in metafunc.fixturenames:
+        metafunc.parametrize("use_dev", [use_dev], scope='session')
     
 
 @pytest.fixture(scope='session')
@@ -0,0 +1,167 @@
+"""
+Local stand-in for the Blackfynn API/streaming server, used to test
+timeseries retrieval offline.
+
+Serves:
+ - GET /timeseries/{pkg}/channels
+ - GET /ts/retrieve/continuous (JSON, or protobuf when accepted)
+"""
+
+import json
+import time
+import threading
+import urlparse
+import numpy as np
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from blackfynn.cache.cache_segment_pb2 import CacheSegment
+
+PROTOBUF_CONTENT_TYPE = 'application/x-protobuf'
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query, keep_blank_values=True))
+        server = self.server.stand_in
+
+        parts = url.path.strip('/').split('/')
+        if url.path == '/ts/retrieve/continuous':
+            server.request_started()
+            try:
+                self._continuous(server, params)
+            finally:
+                server.request_finished()
+        elif len(parts) == 3 and parts[0] == 'timeseries' and parts[2] == 'channels':
+            server.log_channels_request(parts[1])
+            self._send(200, 'application/json', json.dumps(server.channels_json(parts[1])))
+        else:
+            self._send(404, 'text/plain', 'not found')
+
+    def _continuous(self, server, params):
+        channel = params['channel']
+        start, end = long(params['start']), long(params['end'])
+        times, values = server.channel_data(channel, start, end)
+        if params.get('limit'):
+            times, values = times[:int(params['limit'])], values[:int(params['limit'])]
+        binary = server.binary and PROTOBUF_CONTENT_TYPE in self.headers.get('Accept', '')
+        server.log_request(channel, start, end, binary)
+        time.sleep(server.delay)
+        if server.error_page:
+            self._send(200, 'text/html', '<html><body>Service unavailable</body></html>')
+        elif binary:
+            segment = CacheSegment()
+            segment.channelId = channel
+            segment.index = (times*1000).tobytes()
+            segment.data = values.tobytes()
+            self._send(200, PROTOBUF_CONTENT_TYPE, segment.SerializeToString())
+        else:
+            body = json.dumps([[long(t), float(v)] for t,v in zip(times, values)])
+            self._send(200, 'application/json', body)
+
+    def _send(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StreamingServer(object):
+    """
+    Serves deterministic data for a set of channels. Each channel is a dict
+    with ``id``, ``name``, ``rate``, ``start``, ``end`` and optional ``gaps``
+    (list of (start, end) usec ranges with no data). Event channels (``type``
+    'EVENT') have a list of ``events`` (usecs) instead of regular samples.
+    Sample values equal the sample timestamp (in seconds), which makes
+    results easy to check. Requests honor the ``limit`` (number of samples)
+    parameter.
+
+    Data responses are sent after ``delay`` seconds; ``max_active`` is the
+    largest number of data requests that were handled at once. With
+    ``error_page``, data requests get an HTML page (as from a proxy) instead.
+    """
+    def __init__(self, channels, package_id='N:package:stand-in', binary=True, delay=0):
+        self.package_id = package_id
+        self.channels   = {ch['id']: ch for ch in channels}
+        self.binary     = binary
+        self.delay      = delay
+        self.error_page = False
+        self.active     = 0
+        self.max_active = 0
+        self.requests   = []
+        self.channel_requests = []
+        self._lock      = threading.Lock()
+        self._server    = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.stand_in = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def log_request(self, channel, start, end, binary):
+        with self._lock:
+            self.requests.append(dict(channel=channel, start=start, end=end, binary=binary))
+
+    def request_started(self):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+    def request_finished(self):
+        with self._lock:
+            self.active -= 1
+
+    def log_channels_request(self, package_id):
+        with self._lock:
+            self.channel_requests.append(package_id)
+
+    def channels_json(self, package_id):
+        return [{
+            'content': {
+                'id':          ch['id'],
+                'name':        ch['name'],
+                'rate':        ch['rate'],
+                'start':       ch['start'],
+                'end':         ch['end'],
+                'unit':        'uV',
+                'channelType': ch.get('type', 'CONTINUOUS'),
+            },
+            'properties': [],
+        } for ch in self.channels.values()]
+
+    def channel_data(self, channel_id, start, end):
+        ch = self.channels[channel_id]
+        if 'events' in ch:
+            times = np.array(ch['events'], dtype=np.int64)
+            times = times[(times >= start) & (times < end)]
+            return times, times/1.0e6
+        period = 1.0e6/ch['rate']
+        start = max(start, ch['start'])
+        end   = min(end, ch['end'])
+        first = long(np.ceil((start - ch['start'])/period))
+        last  = long(np.ceil((end - ch['start'])/period))
+        times = (ch['start'] + np.arange(first, max(first, last))*period).astype(np.int64)
+        for gap_start, gap_end in ch.get('gaps', []):
+            times = times[(times < gap_start) | (times >= gap_end)]
+        return times, times/1.0e6
@@ -0,0 +1,927 @@
+"""
+Timeseries retrieval tests, run offline against a local stand-in server.
+"""
+
+import os
+import pytest
+import numpy as np
+import pandas as pd
+
+from blackfynn import settings, TimeSeries
+from blackfynn.base import ClientSession
+from blackfynn.api.core import CoreAPI
+from blackfynn.api import timeseries
+from blackfynn.api.timeseries import TimeSeriesAPI, open_export
+
+from .streaming_server import StreamingServer
+
+START = 1500000000000000 # usecs
+LENGTH = 200*1000000     # 200 seconds
+
+CHANNELS = [
+    dict(id='N:channel:stand-in-1', name='ch1', rate=100.0, start=START, end=START+LENGTH),
+    dict(id='N:channel:stand-in-2', name='ch2', rate=100.0, start=START, end=START+LENGTH),
+]
+
+
+MIXED_RATE_CHANNELS = [
+    dict(id='N:channel:stand-in-eeg', name='eeg', rate=256.0, start=START, end=START+LENGTH),
+    dict(id='N:channel:stand-in-hr', name='hr', rate=1.0, start=START, end=START+LENGTH),
+]
+
+GAP_CHANNELS = [
+    dict(id='N:channel:stand-in-gap', name='gap', rate=100.0, start=START, end=START+LENGTH,
+         gaps=[(START+50*1000000, START+150*1000000)]),
+]
+
+EVENTS = (START + np.cumsum(np.random.RandomState(0).randint(1, 200000, size=2500))).tolist()
+EVENT_CHANNELS = [
+    dict(id='N:channel:stand-in-spikes', name='spikes', rate=100.0, type='EVENT',
+         start=EVENTS[0], end=EVENTS[-1], events=EVENTS),
+]
+
+
+def make_timeseries(server):
+    session = ClientSession(host=server.url, streaming_host=server.url)
+    session.register(CoreAPI, TimeSeriesAPI)
+    session.timeseries.host = server.url
+    ts = TimeSeries('stand-in')
+    ts.id = server.package_id
+    ts._api = session
+    return ts
+
+
+@pytest.fixture(autouse=True)
+def small_pages(monkeypatch):
+    """
+    Use pages of 3600 samples, so that requests span several pages.
+    """
+    monkeypatch.setattr(settings, 'ts_page_bytes', 3600*16)
+
+
+@pytest.fixture()
+def stand_in():
+    server = StreamingServer(CHANNELS).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture()
+def mixed_stand_in():
+    server = StreamingServer(MIXED_RATE_CHANNELS).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture()
+def gap_stand_in():
+    server = StreamingServer(GAP_CHANNELS).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture()
+def local_cache(tmpdir, monkeypatch):
+    """
+    Use a fresh page cache in a temporary directory.
+    """
+    cache_dir = str(tmpdir.mkdir('cache'))
+    monkeypatch.setattr(settings, 'cache_dir', cache_dir)
+    monkeypatch.setattr(settings, 'cache_index', os.path.join(cache_dir, 'index.db'))
+    monkeypatch.setattr(timeseries, 'cache', None)
+    yield cache_dir
+    monkeypatch.setattr(timeseries, 'cache', None)
+
+
+@pytest.fixture()
+def cache_channel(local_cache):
+    """
+    Returns (cache, channel) of a fresh page cache and a 100 Hz channel.
+    """
+    from blackfynn.cache.cache import Cache
+    from blackfynn.models import TimeSeriesChannel
+    cache = Cache()
+    cache.init_tables()
+    ch = TimeSeriesChannel('ch', rate=100.0)
+    ch.id = 'N:channel:cached'
+    return cache, ch
+
+
+@pytest.fixture()
+def ts(stand_in):
+    return make_timeseries(stand_in)
+
+
+@pytest.fixture()
+def mixed_ts(mixed_stand_in):
+    return make_timeseries(mixed_stand_in)
+
+
+def check_data(df, start, end):
+    assert list(sorted(df.columns)) == ['ch1', 'ch2']
+    expected = np.arange(start, end, 10000)
+    assert np.array_equal(df.index.values.astype('datetime64[us]').astype(np.int64), expected)
+    for col in df.columns:
+        assert np.allclose(df[col].values, expected/1.0e6)
+
+
+def test_parse_timedelta():
+    assert timeseries.parse_timedelta('1h') == timeseries.parse_timedelta('1hr') == 3600*1000000
+    assert timeseries.parse_timedelta('24h') == 24*3600*1000000
+    assert timeseries.parse_timedelta('1h30m') == 5400*1000000
+    assert timeseries.parse_timedelta('5m') == 300*1000000
+    assert timeseries.parse_timedelta('1.5s') == 1500000
+
+
+def test_decode_response_json(monkeypatch):
+    # out of order pairs are sorted (stable for equal times)
+    times, values = timeseries.decode_response([[30, 3.0], [10, 1.0], [20, 2.0], [10, 1.5]])
+    assert times.dtype == np.int64
+    assert times.tolist() == [10000, 10000, 20000, 30000]
+    assert values.tolist() == [1.0, 1.5, 2.0, 3.0]
+
+    # already in order: not reordered
+    monkeypatch.setattr(timeseries.np, 'argsort', None)
+    times, values = timeseries.decode_response([[10, 1.0], [10, 0.5], [20, 2.0]])
+    assert times.tolist() == [10000, 10000, 20000]
+    assert values.tolist() == [1.0, 0.5, 2.0]
+
+    times, values = timeseries.decode_response([])
+    assert len(times) == len(values) == 0
+    assert times.dtype == np.int64
+
+
+def test_get_data_binary(ts, stand_in):
+    start, end = START + 1234567, START + 61234567
+    df = ts.get_data(start=start, end=end, use_cache=False)
+    check_data(df, START + 1240000, end)
+    assert stand_in.requests
+    assert all(r['binary'] for r in stand_in.requests)
+
+
+def test_get_data_json_fallback(ts, stand_in):
+    stand_in.binary = False
+    start, end = START + 1234567, START + 61234567
+    df = ts.get_data(start=start, end=end, use_cache=False)
+    check_data(df, START + 1240000, end)
+    assert not any(r['binary'] for r in stand_in.requests)
+
+
+def test_get_data_json_only_client(ts, stand_in, monkeypatch):
+    monkeypatch.setattr(settings, 'ts_binary_transfer', False)
+    df = ts.get_data(start=START, length='30s', use_cache=False)
+    check_data(df, START, START + 30*1000000)
+    assert not any(r['binary'] for r in stand_in.requests)
+
+
+def test_get_data_unexpected_response(ts, stand_in):
+    # a non-protobuf, non-JSON body isn't decoded as data
+    stand_in.error_page = True
+    with pytest.raises(Exception) as e:
+        ts.get_data(start=START, length='30s', use_cache=False)
+    assert 'Unexpected timeseries data response' in str(e.value)
+
+
+def test_get_data_iter_chunks(ts, stand_in):
+    start, end = START + 1234567, START + 101234567
+    chunks = list(ts.get_data_iter(start=start, end=end, chunk_size='7s', use_cache=False))
+    sizes = [len(c) for c in chunks]
+    assert sizes[:-1] == [700]*(len(sizes)-1)
+    assert 0 < sizes[-1] <= 700
+    check_data(pd.concat(chunks), START + 1240000, end)
+
+
+def test_get_data_numpy(ts, stand_in):
+    start, end = START + 1234567, START + 61234567
+    df = ts.get_data(start=start, end=end, use_cache=False)
+    data, times = ts.get_data(start=start, end=end, use_cache=False, output='numpy')
+    assert data.shape == (2, len(df))
+    assert times.dtype == np.int64
+    assert np.array_equal(times, df.index.values.astype('datetime64[us]').astype(np.int64))
+    names = [ch.name for ch in ts.channels]
+    for row, name in zip(data, names):
+        assert np.array_equal(row, df[name].values)
+
+    chunks = list(ts.get_data_iter(start=start, end=end, chunk_size='7s', use_cache=False, output='numpy'))
+    assert all(d.shape == (2, len(t)) for d,t in chunks)
+    assert np.array_equal(np.concatenate([t for _,t in chunks]), times)
+
+
+def test_get_data_cached(ts, stand_in, local_cache):
+    start, end = START + 1234567, START + 61234567
+    df = ts.get_data(start=start, end=end, use_cache=True)
+    check_data(df, START + 1240000, end)
+    n_requests = len(stand_in.requests)
+    assert n_requests > 0
+
+    # served from cache
+    df2 = ts.get_data(start=start, end=end, use_cache=True)
+    assert len(stand_in.requests) == n_requests
+    assert df2.equals(df)
+
+
+def test_align_native_and_rate(mixed_ts):
+    data = mixed_ts.get_data(start=START, length='20s', use_cache=False, align='native')
+    assert sorted(data.keys()) == ['eeg', 'hr']
+    assert len(data['eeg']) == 20*256
+    assert len(data['hr']) == 20
+
+    # chunks don't point into (read-only) response buffers
+    for output in ('pandas', 'numpy'):
+        chunk = next(iter(mixed_ts.get_data_iter(start=START, length='20s', use_cache=False,
+                                                 align='native', output=output)))
+        values = chunk['eeg'].values if output == 'pandas' else chunk['eeg'][0]
+        values[0] = 1
+
+    # per-channel (values, times), like (data, times) of other numpy output
+    values, times = mixed_ts.get_data(start=START, length='20s', use_cache=False,
+                                      align='native', output='numpy')['hr']
+    assert np.array_equal(times, START + np.arange(20)*1000000)
+    assert np.allclose(values, times/1.0e6)
+
+    data = mixed_ts.get_data(start=START, length='20s', use_cache=False, align='rate')
+    assert sorted(data.keys()) == [1.0, 256.0]
+    assert list(data[256.0].columns) == ['eeg']
+    assert len(data[1.0]) == 20
+
+
+def test_align_resample(mixed_ts):
+    df = mixed_ts.get_data(start=START, length='20s', use_cache=False, align='nearest')
+    assert len(df) == 20*256
+    assert sorted(df.columns) == ['eeg', 'hr']
+    t = df.index.values.astype('datetime64[us]').astype(np.int64)
+    assert np.allclose(df['eeg'].values, t/1.0e6)
+    # nearest 1 Hz sample (earlier sample on ties), none after last sample + 0.5s
+    valid = t <= START + 19500000
+    nearest = START + np.ceil((t - START - 500000)/1.0e6)*1000000
+    assert np.allclose(df['hr'].values[valid], nearest[valid]/1.0e6)
+    assert np.isnan(df['hr'].values[~valid]).all()
+
+    df = mixed_ts.get_data(start=START, length='20s', use_cache=False, align='linear', rate=10)
+    assert len(df) == 200
+    t = df.index.values.astype('datetime64[us]').astype(np.int64)
+    valid = t <= START + 19*1000000
+    assert np.allclose(df['hr'].values[valid], t[valid]/1.0e6)
+    assert np.isnan(df['hr'].values[~valid]).all()
+
+
+def test_get_data_decimated(ts, stand_in):
+    start, end = START, START + 100*1000000
+    df = ts.get_data(start=start, end=end, use_cache=False)
+
+    env = ts.get_data(start=start, end=end, use_cache=False, max_points=200)
+    assert sorted(env.columns) == ['ch1', 'ch2']
+    assert 0 < len(env) <= 200
+    assert env['ch1'].min() == df['ch1'].min()
+    assert env['ch1'].max() == df['ch1'].max()
+
+    env = ts.get_data(start=start, end=end, use_cache=False, max_points=200, decimate='lttb')
+    assert len(env) == 200
+    assert env.index[0] == df.index[0]
+    assert env.index[-1] == df.index[-1]
+
+
+@pytest.mark.parametrize('format', ['npy', 'raw'])
+def test_export(mixed_ts, tmpdir, format):
+    path = str(tmpdir.join('export.' + format))
+    metadata = mixed_ts.export(path, start=START, length='20s', format=format)
+    assert [ch['n_samples'] for ch in metadata['channels']] == [20*256, 20]
+
+    data, metadata = open_export(path)
+    assert data.shape == (2, 20*256)
+    for row, ch in zip(data, metadata['channels']):
+        n = ch['n_samples']
+        expected = (START + np.arange(n)*1.0e6/ch['rate'])/1.0e6
+        assert np.allclose(row[:n], expected)
+        assert np.isnan(row[n:]).all()
+
+
+def test_get_data_async(ts, stand_in):
+    futures = [ts.get_data_async(start=START + i*10000000, length='10s', use_cache=False) for i in range(4)]
+    for i, future in enumerate(futures):
+        check_data(future.result(timeout=60), START + i*10000000, START + (i+1)*10000000)
+
+
+def test_get_data_async_cached(ts, stand_in, local_cache):
+    futures = [ts.get_data_async(start=START + i*10000000, length='10s', use_cache=True) for i in range(4)]
+    for i, future in enumerate(futures):
+        check_data(future.result(timeout=60), START + i*10000000, START + (i+1)*10000000)
+    df = ts.get_data(start=START, length='40s', use_cache=True)
+    check_data(df, START, START + 40000000)
+
+
+def test_get_data_many(ts, stand_in):
+    other = make_timeseries(stand_in)
+    other.id = 'N:package:stand-in-2'
+    results = dict(ts._api.timeseries.get_ts_data_many([ts, other], start='10s', length='20s'))
+    assert sorted(t.id for t in results) == sorted([ts.id, other.id])
+    for df in results.values():
+        check_data(df, START + 10000000, START + 30000000)
+
+    results = list(ts._api.timeseries.get_ts_data_many([ts], length='5s', channel_names=['ch1'],
+                                                        output='numpy'))
+    assert len(results) == 1
+    data, times = results[0][1]
+    assert data.shape == (1, 500)
+    assert np.allclose(data[0], times/1.0e6)
+
+
+def test_channel_cache(ts, stand_in, monkeypatch):
+    ts.get_data(start=START, length='5s', use_cache=False)
+    ts.get_data(start=START, length='5s', use_cache=False)
+    assert ts.limits() == (START, START + LENGTH)
+    assert len(stand_in.channel_requests) == 1
+
+    ts.refresh_channels()
+    ts.channels
+    assert len(stand_in.channel_requests) == 2
+
+    monkeypatch.setattr(settings, 'ts_channel_cache_ttl', 0)
+    ts.channels
+    ts.channels
+    assert len(stand_in.channel_requests) == 4
+
+
+def test_channel_cache_copies(ts, stand_in):
+    ch = ts.channels[0]
+    name = ch.name
+    ch.name = 'renamed'
+    del ch.properties[:]
+    again = dict((c.id, c) for c in ts._api.timeseries.get_cached_channels(ts))[ch.id]
+    assert len(stand_in.channel_requests) == 1
+    assert again is not ch
+    assert again.name == name
+    assert again.properties
+    assert again._api is ch._api
+
+
+def test_segments_and_gaps(gap_stand_in, local_cache, monkeypatch):
+    ts = make_timeseries(gap_stand_in)
+    ch = ts.channels[0]
+    df = ts.get_data(start=START, length=LENGTH, use_cache=True)
+    assert len(df) == 10000
+    assert ch.segments == [(START, START+50*1000000), (START+150*1000000, START+LENGTH)]
+    assert ch.gaps == [(START+50*1000000, START+150*1000000)]
+
+    # page status is read with a single query, known empty pages are skipped entirely
+    read = []
+    get_page_data = timeseries.cache.get_page_data
+    monkeypatch.setattr(timeseries.cache, 'get_page_data',
+                        lambda c, p, **kwargs: read.append(p) or get_page_data(c, p, **kwargs))
+    monkeypatch.setattr(timeseries.cache, 'check_page', None)
+    df = ts.get_data(start=START, length=LENGTH, use_cache=True)
+    assert len(df) == 10000
+    period = ch._page_delta(timeseries.channel_page_size(ch))
+    assert read
+    assert not [p for p in read if START+50*1000000 <= p*period and (p+1)*period <= START+150*1000000]
+
+
+OFFSET_CHANNELS = [
+    CHANNELS[0],
+    dict(id='N:channel:stand-in-late', name='late', rate=100.0, start=START+40*1000000, end=START+LENGTH),
+    dict(GAP_CHANNELS[0]),
+]
+
+
+def check_combined(df):
+    # one row per sample time, each channel's samples at their own times
+    t = df.index.values.astype('datetime64[us]').astype(np.int64)
+    assert df.index.is_unique
+    assert np.array_equal(t, np.arange(START, START + LENGTH, 10000))
+    counts = df.count()
+    assert (counts['ch1'], counts['late'], counts['gap']) == (20000, 16000, 10000)
+    for name in df.columns:
+        present = df[name].notnull().values
+        assert np.allclose(df[name].values[present], t[present]/1.0e6)
+
+
+def test_get_data_offset_channels_and_gaps(local_cache):
+    server = StreamingServer(OFFSET_CHANNELS).start()
+    try:
+        ts = make_timeseries(server)
+        check_combined(ts.get_data(start=START, length=LENGTH, use_cache=False))
+        # known empty pages are skipped on the second read
+        for i in range(2):
+            check_combined(ts.get_data(start=START, length=LENGTH, use_cache=True))
+        data, times = ts.get_data(start=START, length=LENGTH, use_cache=True, output='numpy')
+        assert np.array_equal(times, np.arange(START, START + LENGTH, 10000))
+        chunks = list(ts.get_data_iter(start=START, length=LENGTH, chunk_size='7s', use_cache=True))
+        check_combined(pd.concat(chunks))
+        results = list(ts._api.timeseries.get_ts_data_many([ts], start=START, length=LENGTH))
+        check_combined(results[0][1])
+    finally:
+        server.stop()
+
+
+def test_page_status(cache_channel):
+    from blackfynn.cache.cache import PAGE_MISSING, PAGE_EMPTY, PAGE_PRESENT
+    cache, ch = cache_channel
+    empty = np.empty(0, dtype=np.int64), np.empty(0)
+    for page in [12, 10, 11, 14]:
+        cache.set_page_data(ch, page, empty)
+    cache.set_page_data(ch, 13, (np.arange(10, dtype=np.int64)*10000000, np.zeros(10)))
+    with cache.index_con as con:
+        ranges = con.execute("SELECT start, end FROM ts_empty_pages ORDER BY start").fetchall()
+    assert ranges == [(10, 13), (14, 15)]
+    assert list(cache.page_status(ch, 9, 16)) == \
+        [PAGE_MISSING, PAGE_EMPTY, PAGE_EMPTY, PAGE_EMPTY, PAGE_PRESENT, PAGE_EMPTY, PAGE_MISSING]
+    assert cache.check_page(ch, 11) and not cache.check_page(ch, 15)
+    assert cache.page_has_data(ch, 13) and cache.page_has_data(ch, 12) is False
+
+
+def test_pages_outside_channel_range(ts, stand_in):
+    ts.get_data(start=START - LENGTH, length=3*LENGTH, use_cache=False)
+    assert stand_in.requests
+    assert all(r['end'] > START and r['start'] <= START + LENGTH for r in stand_in.requests)
+
+
+def test_channel_page_size(local_cache, monkeypatch):
+    from blackfynn.cache.cache import Cache
+    from blackfynn.models import TimeSeriesChannel
+    monkeypatch.setattr(settings, 'ts_page_bytes', 1024*1024)
+    monkeypatch.setattr(settings, 'ts_page_size', 1000)
+    cache = Cache()
+    cache.init_tables()
+    fast, slow, legacy = [TimeSeriesChannel(name, rate=rate) for name, rate in
+                          [('fast', 30000.0), ('slow', 1.0), ('legacy', 30000.0)]]
+    for ch in (fast, slow, legacy):
+        ch.id = 'N:channel:' + ch.name
+
+    # channel with pages in an existing cache keeps the cache's page size
+    cache.set_page_data(legacy, 1, (np.empty(0, dtype=np.int64), np.empty(0)))
+    assert cache.channel_page_size(fast) == 65536
+    assert cache.channel_page_size(slow) == 3600
+    assert cache.channel_page_size(legacy) == 1000
+
+    # page sizes are recorded in the index
+    monkeypatch.setattr(settings, 'ts_page_bytes', 1024)
+    cache = Cache()
+    assert cache.channel_page_size(fast) == 65536
+
+
+def test_coalesced_page_requests(ts, stand_in, local_cache, monkeypatch):
+    # 200s of 36s pages, one request per channel
+    df = ts.get_data(start=START, length=LENGTH, use_cache=True)
+    check_data(df, START, START + LENGTH)
+    assert len(stand_in.requests) == 2
+
+    # response was split into pages for the cache
+    stand_in.requests[:] = []
+    df2 = ts.get_data(start=START + 40000000, length='100s', use_cache=True)
+    check_data(df2, START + 40000000, START + 140000000)
+    assert not stand_in.requests
+
+    # requests are capped at ts_max_request_bytes
+    monkeypatch.setattr(settings, 'ts_max_request_bytes', 2*3600*16)
+    df = ts.get_data(start=START, length=LENGTH, use_cache=False)
+    check_data(df, START, START + LENGTH)
+    span = ts.channels[0]._page_delta(3600)
+    assert len(stand_in.requests) > 2
+    assert all(r['end'] - r['start'] <= 2*span for r in stand_in.requests)
+
+
+def test_close_data_iter(ts, stand_in, monkeypatch):
+    monkeypatch.setattr(settings, 'ts_max_request_bytes', 3600*16)
+    cancelled = []
+    cancel = timeseries.PageRange.cancel
+    monkeypatch.setattr(timeseries.PageRange, 'cancel', lambda r: cancelled.append(r) or cancel(r))
+    with ts.get_data_iter(start=START, length=LENGTH, chunk_size='10s', use_cache=False) as chunks:
+        check_data(next(chunks), START, START + 10000000)
+        scheduler = chunks.scheduler
+        assert scheduler.pending > 0
+    assert cancelled
+    assert scheduler.pending == 0
+    assert not scheduler.iterators
+    assert list(chunks) == []
+
+
+def test_data_timeout(ts, stand_in, tmpdir):
+    with pytest.raises(Exception) as e:
+        ts.get_data(start=START, length=LENGTH, use_cache=False, timeout=-1)
+    assert 'timeout' in str(e.value)
+    with pytest.raises(Exception):
+        ts.export(str(tmpdir.join('data.npy')), start=START, length=LENGTH, timeout=-1)
+
+
+def test_get_windows(ts, stand_in, local_cache):
+    windows = [(START + 1000000, START + 3000000),
+               (START + 2000000, START + 4000000),
+               (START + 100000000, START + 101000000)]
+    data = ts.get_windows(windows, use_cache=True)
+    assert data.shape == (3, 2, 200)
+    for (start, end), window in zip(windows, data):
+        n = (end - start)//10000
+        expected = (start + np.arange(n)*10000)/1.0e6
+        for row in window:
+            assert np.allclose(row[:n], expected)
+            assert np.isnan(row[n:]).all()
+
+    # overlapping windows share pages, each page is requested once
+    pages = [(r['channel'], r['start']) for r in stand_in.requests]
+    assert len(pages) == len(set(pages)) == 4
+
+    # served from cache
+    stand_in.requests[:] = []
+    np.testing.assert_array_equal(ts.get_windows(windows, use_cache=True), data)
+    assert not stand_in.requests
+
+
+def test_get_events(local_cache, monkeypatch):
+    monkeypatch.setattr(settings, 'ts_event_page_size', 1000)
+    server = StreamingServer(EVENT_CHANNELS).start()
+    try:
+        ch = make_timeseries(server).channels[0]
+        assert ch.channel_type == 'EVENT'
+        events = ch.get_events(use_cache=True)
+        assert events.dtype == np.int64
+        assert events.tolist() == EVENTS
+        # paged by event count
+        assert len(server.requests) == 3
+
+        # served from cache, also for a sub-range
+        server.requests[:] = []
+        assert ch.get_events(use_cache=True).tolist() == EVENTS
+        start, end = EVENTS[100], EVENTS[1500]
+        times, values = ch.get_events(start=start, end=end, use_cache=True, values=True)
+        assert times.tolist() == EVENTS[100:1500]
+        assert np.allclose(values, times/1.0e6)
+        assert not server.requests
+
+        # only ranges not cached before are requested
+        ch.get_events(start=EVENTS[0]-1000000, end=EVENTS[10], use_cache=True)
+        assert [(r['start'], r['end']) for r in server.requests] == [(EVENTS[0]-1000000, EVENTS[0])]
+    finally:
+        server.stop()
+
+
+def test_aggregate(ts, stand_in):
+    start = START + 1234567
+    stats = ['count', 'mean', 'std', 'rms', 'min', 'max', 'line_length']
+    # pages span 36s, so some windows are split across pages
+    df = ts.aggregate(stats, window='10s', start=start, length='95s', use_cache=False)
+    assert sorted(df.columns.levels[0]) == ['ch1', 'ch2']
+    assert len(df) == 10
+
+    times = np.arange(START + 1240000, start + 95000000, 10000)
+    values = times/1.0e6
+    ids = (times - start)//10000000
+    expected_start = start + np.arange(10)*10000000
+    assert np.array_equal(df.index.values.astype('datetime64[us]').astype(np.int64), expected_start)
+    for name in ('ch1', 'ch2'):
+        result = df[name]
+        for i in range(10):
+            v = values[ids == i]
+            assert result['count'].iloc[i] == len(v)
+            assert np.isclose(result['mean'].iloc[i], v.mean())
+            assert np.isclose(result['std'].iloc[i], v.std(), rtol=1e-6)
+            assert np.isclose(result['rms'].iloc[i], np.sqrt((v*v).mean()))
+            assert result['min'].iloc[i] == v.min()
+            assert result['max'].iloc[i] == v.max()
+            assert np.isclose(result['line_length'].iloc[i], np.abs(np.diff(v)).sum())
+
+
+def test_cached_page_index_batched(ts, stand_in, local_cache, monkeypatch):
+    monkeypatch.setattr(settings, 'cache_access_flush_interval', 3600)
+    df = ts.get_data(start=START, length=LENGTH, use_cache=True)
+
+    # warm read: page index is read and updated per channel run, not per page
+    touched = []
+    touch_pages = timeseries.cache.touch_pages
+    monkeypatch.setattr(timeseries.cache, 'touch_pages',
+                        lambda c, pages: touched.append(pages) or touch_pages(c, pages))
+    monkeypatch.setattr(timeseries.cache, 'update_page', None)
+    monkeypatch.setattr(timeseries.cache, 'check_page', None)
+    assert ts.get_data(start=START, length=LENGTH, use_cache=True).equals(df)
+    n_pages = sum(len(t) for t in touched)
+    assert len(touched) < n_pages
+
+    # access statistics are buffered
+    query = "SELECT access_count FROM ts_pages"
+    with timeseries.cache.index_con as con:
+        assert set(con.execute(query).fetchall()) == set([(0,)])
+    timeseries.cache.flush_access()
+    with timeseries.cache.index_con as con:
+        counts = con.execute(query).fetchall()
+    assert len(counts) == n_pages
+    assert set(counts) == set([(1,)])
+
+
+def test_access_statistics_flush_threshold(cache_channel, monkeypatch):
+    monkeypatch.setattr(settings, 'cache_access_flush_interval', 3600)
+    monkeypatch.setattr(settings, 'cache_access_flush_pages', 3)
+    cache, ch = cache_channel
+    for page in range(4):
+        cache.set_page(ch, page, True)
+
+    query = "SELECT page, access_count FROM ts_pages ORDER BY page"
+    cache.touch_pages(ch, [0, 1])
+    cache.touch_pages(ch, [1])
+    with cache.index_con as con:
+        assert [r[1] for r in con.execute(query)] == [0, 0, 0, 0]
+    cache.touch_pages(ch, [2])
+    with cache.index_con as con:
+        assert [r[1] for r in con.execute(query)] == [1, 2, 1, 0]
+
+
+def test_access_statistics_flushed_at_exit(ts, stand_in, local_cache, monkeypatch):
+    # a single exit handler, for the shared cache only
+    from blackfynn.cache.cache import get_cache
+    import atexit
+    registered = []
+    monkeypatch.setattr(atexit, 'register', registered.append)
+    get_cache()
+    assert not registered
+
+    monkeypatch.setattr(settings, 'cache_access_flush_interval', 3600)
+    ts.get_data(start=START, length='60s', use_cache=True)
+    ts.get_data(start=START, length='60s', use_cache=True)
+    assert timeseries.cache._page_access
+    timeseries._flush_page_cache()
+    with timeseries.cache.index_con as con:
+        assert con.execute("SELECT SUM(access_count) FROM ts_pages").fetchone()[0] > 0
+
+
+def _read_shared_cache(args):
+    from blackfynn.cache.cache import Cache, PAGE_PRESENT
+    from blackfynn.models import TimeSeriesChannel
+    channel_id, n_pages = args
+    ch = TimeSeriesChannel('ch', rate=100.0)
+    ch.id = channel_id
+    cache = Cache()
+    for i in range(20):
+        status = cache.page_status(ch, 0, n_pages)
+        assert (status == PAGE_PRESENT).all()
+        for page in range(n_pages):
+            assert len(cache.get_page_data(ch, page, has_data=True)[0]) == 10
+        cache.flush_access()
+    return True
+
+
+def test_cache_shared_by_processes(cache_channel, monkeypatch):
+    import multiprocessing as mp
+    cache, ch = cache_channel
+    times = np.arange(10, dtype=np.int64)
+    for page in range(8):
+        cache.set_page_data(ch, page, (times + page*10, times/1.0))
+    with cache.index_con as con:
+        assert con.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+    pool = mp.Pool(16)
+    try:
+        assert all(pool.map(_read_shared_cache, [(ch.id, 8)]*32))
+    finally:
+        pool.close()
+        pool.join()
+
+    # connections aren't shared with forked processes
+    conn = cache.index_con
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    assert cache.index_con is not conn
+
+
+def test_cache_size_accounting(cache_channel, monkeypatch):
+    from blackfynn.cache import cache as cache_module
+    from blackfynn.cache.cache import remove_old_pages, PAGE_MISSING, PAGE_EMPTY, PAGE_PRESENT
+    cache, ch = cache_channel
+    for page in range(6):
+        times = np.arange(10*(page+1), dtype=np.int64)
+        cache.set_page_data(ch, page, (times, times/1.0))
+    cache.set_page_data(ch, 6, (np.empty(0, dtype=np.int64), np.empty(0)))
+    cache.set_event_block(ch, 0, 10, np.arange(5, dtype=np.int64), np.zeros(5))
+
+    def file_bytes():
+        return sum(os.stat(f).st_size for f in cache.page_files)
+
+    # size is read from the index, page files aren't listed
+    expected = file_bytes()
+    with monkeypatch.context() as m:
+        m.setattr(cache_module, 'glob', None)
+        assert cache.size == expected + os.stat(cache.index_loc).st_size
+
+        # rewritten page
+        times = np.arange(100, dtype=np.int64)
+        cache.set_page_data(ch, 0, (times, times/1.0), update=True)
+    expected = file_bytes()
+    assert cache.size - os.stat(cache.index_loc).st_size == expected
+
+    # eviction removes just enough of the least recently used pages
+    with cache.index_con as con:
+        con.execute("UPDATE ts_pages SET last_access='2000-01-01' WHERE page IN (2, 3)")
+        page_bytes = dict(con.execute("SELECT page, bytes FROM ts_pages"))
+    removed = remove_old_pages(cache, page_bytes[2] + 1)
+    assert removed == page_bytes[2] + page_bytes[3]
+    assert cache.page_status(ch, 0, 7).tolist() == [PAGE_PRESENT]*2 + [PAGE_MISSING]*2 + [PAGE_PRESENT]*2 + [PAGE_EMPTY]
+    assert cache.size - os.stat(cache.index_loc).st_size == file_bytes() == expected - removed
+
+
+def test_cache_dir_created_concurrently(cache_channel, monkeypatch):
+    # another thread (or process) creates the channel directory first
+    cache, ch = cache_channel
+    makedirs = os.makedirs
+    def racing_makedirs(path, *args):
+        makedirs(path, *args)
+        makedirs(path, *args)
+    monkeypatch.setattr(os, 'makedirs', racing_makedirs)
+
+    times = np.arange(10, dtype=np.int64)
+    cache.set_page_data(ch, 0, (times, times/1.0))
+    other = timeseries.TimeSeriesChannel('other', rate=100.0)
+    other.id = 'N:channel:other'
+    cache.set_event_block(other, 0, 10, times, np.zeros(10))
+    assert os.path.exists(cache.page_file(ch.id, 0))
+    assert os.path.exists(cache.event_block_file(other.id, 0))
+
+
+def test_cache_index_failure_removes_files(cache_channel, monkeypatch):
+    import sqlite3
+    cache, ch = cache_channel
+
+    def fail(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(cache, 'set_page', fail)
+    monkeypatch.setattr(cache, '_add_bytes', fail)
+
+    times = np.arange(10, dtype=np.int64)
+    cache.set_page_data(ch, 0, (times, times/1.0))
+    cache.set_event_block(ch, 0, 10, times, np.zeros(10))
+    assert not os.path.exists(cache.page_file(ch.id, 0))
+    assert not os.path.exists(cache.event_block_file(ch.id, 0))
+
+
+def test_empty_range_numpy_shape(ts):
+    # no pages at all past the end of the channels
+    api = ts._api.timeseries
+    start, end = START + 10*LENGTH, START + 11*LENGTH
+    data, times = api.get_ts_data(ts, start, end, None, None, use_cache=False, output='numpy')
+    assert data.shape == (2, 0)
+    assert times.shape == (0,)
+    results = list(api.get_ts_data_many([ts], start=start, end=end, use_cache=False, output='numpy'))
+    assert results[0][1][0].shape == (2, 0)
+
+
+def test_channel_without_data_keeps_column(local_cache):
+    # 'late' has no samples in the first 10 seconds
+    server = StreamingServer(OFFSET_CHANNELS).start()
+    try:
+        ts = make_timeseries(server)
+        names = [ch.name for ch in ts.channels]
+        df = ts.get_data(start=START, length='10s', use_cache=False)
+        assert list(df.columns) == names
+        assert df['late'].isnull().all() and df['ch1'].count() == 1000
+        chunks = list(ts.get_data_iter(start=START, length='10s', chunk_size='3s', use_cache=False))
+        assert all(list(c.columns) == names for c in chunks)
+        results = list(ts._api.timeseries.get_ts_data_many([ts], start=START, length='10s', use_cache=False))
+        assert list(results[0][1].columns) == names
+
+        # pandas output matches numpy output
+        data, times = ts.get_data(start=START, length='10s', use_cache=False, output='numpy')
+        assert np.array_equal(np.isnan(data), df.isnull().values.T)
+
+        # empty range
+        df = ts.get_data(start=START + 10*LENGTH, length='10s', use_cache=False)
+        assert df.shape == (0, 3)
+        assert list(df.columns) == names
+    finally:
+        server.stop()
+
+
+def test_aggregate_empty_windows(gap_stand_in):
+    ts = make_timeseries(gap_stand_in)
+    df = ts.aggregate(['count', 'mean'], window='10s', start=START, length=LENGTH, use_cache=False)
+    assert len(df) == 20
+    counts = df['gap']['count'].values
+    assert counts.tolist() == [1000]*5 + [0]*10 + [1000]*5
+    assert np.isnan(df['gap']['mean'].values[5:15]).all()
+
+
+def test_get_data_iter_short_chunks(ts, stand_in):
+    # chunk size shorter than the sample period: one sample per chunk
+    chunks = list(ts.get_data_iter(start=START, length='1s', chunk_size=5000, use_cache=False))
+    assert len(chunks) == 100
+    assert all(len(c) == 1 for c in chunks)
+
+
+def test_default_window_mixed_rates(mixed_ts, monkeypatch):
+    # default chunks follow the shortest page, buffers hold at most the requested range
+    capacities = []
+    init = timeseries.ChunkBuffer.__init__
+    monkeypatch.setattr(timeseries.ChunkBuffer, '__init__',
+                        lambda self, capacity: capacities.append(capacity) or init(self, capacity))
+    chunks = list(mixed_ts.get_data_iter(start=START, length='20s', use_cache=False))
+    assert len(chunks) == 2
+    assert pd.concat(chunks)['eeg'].count() == 20*256
+    assert max(capacities) <= 2*3600
+
+
+def test_get_data_iter_skips_gaps(gap_stand_in, monkeypatch):
+    # windows inside a gap aren't built
+    ts = make_timeseries(gap_stand_in)
+    made = []
+    make_chunk = timeseries.ChannelIterator._make_chunk
+    monkeypatch.setattr(timeseries.ChannelIterator, '_make_chunk',
+                        lambda self, t, v: made.append(len(t)) or make_chunk(self, t, v))
+    chunks = list(ts.get_data_iter(start=START, length=LENGTH, chunk_size=100000, use_cache=False))
+    assert len(chunks) == len(made) == 1000
+    assert all(made)
+    assert len(pd.concat(chunks)) == 10000
+
+
+def test_scheduler_cost_per_page(ts, stand_in, monkeypatch):
+    # issuing requests doesn't scan all registered iterators for every page
+    monkeypatch.setattr(settings, 'ts_max_request_bytes', 3600*16)
+    calls = []
+    request_next = timeseries.ChannelIterator.request_next
+    monkeypatch.setattr(timeseries.ChannelIterator, 'request_next',
+                        lambda it: calls.append(it) or request_next(it))
+    scheduler = timeseries.PageScheduler(max_pending=4)
+    iterators = [
+        timeseries.ChannelIterator(ch, START, START + 100*1000000, None, api=ts._api,
+                                   use_cache=False, scheduler=scheduler, output='numpy')
+        for ch in ts.channels*50
+    ]
+    try:
+        pages = [it.get_pages() for it in iterators]
+        n_pages = 0
+        active = list(pages)
+        while active:
+            for p in list(active):
+                if next(p, None) is None:
+                    active.remove(p)
+                else:
+                    n_pages += 1
+    finally:
+        scheduler.close()
+    assert n_pages == 100*4
+    assert len(calls) < 3*(n_pages + len(iterators))
+    assert scheduler.pending == 0
+
+
+def test_read_ahead_counts_requests(ts, stand_in, monkeypatch):
+    # runs of 3 pages per request, 2 requests ahead
+    monkeypatch.setattr(settings, 'ts_max_request_bytes', 3*3600*16)
+    ch = ts.channels[0]
+    it = timeseries.ChannelIterator(ch, START, START + LENGTH, None, api=ts._api,
+                                    use_cache=False, prefetch_pages=2, output='numpy')
+    while it.request_next() is not None:
+        pass
+    assert it.in_flight == 2
+    assert len(it.pending) == 2*3
+    it.close()
+    assert it.in_flight == 0
+
+
+def test_read_ahead_overlaps_requests(monkeypatch):
+    # one request per page, several kept in flight while pages arrive in order
+    monkeypatch.setattr(settings, 'ts_max_request_bytes', 3600*16)
+    server = StreamingServer(CHANNELS[:1], delay=0.1).start()
+    try:
+        ch = make_timeseries(server).channels[0]
+        it = timeseries.ChannelIterator(ch, START, START + LENGTH, None, api=ch._api,
+                                        use_cache=False, prefetch_pages=4, output='numpy')
+        times = np.concatenate([t for t, v in it.get_chunks()])
+    finally:
+        server.stop()
+    assert len(server.requests) > 4
+    # 4 ahead (plus a response that may still be finishing)
+    assert 1 < server.max_active <= 5
+    assert np.array_equal(times, np.arange(START, START + LENGTH, 10000))
+
+
+def test_scheduler_overlaps_channels(monkeypatch):
+    # a single request ahead per channel, requests of all channels overlap
+    monkeypatch.setattr(settings, 'ts_max_request_bytes', 3600*16)
+    monkeypatch.setattr(settings, 'ts_prefetch_pages', 1)
+    channels = [dict(CHANNELS[0], id='N:channel:stand-in-{}'.format(i), name='ch{}'.format(i))
+                for i in range(4)]
+    server = StreamingServer(channels, delay=0.1).start()
+    try:
+        ts = make_timeseries(server)
+        df = pd.concat(ts._api.timeseries.get_ts_data_iter(ts, START, None, None, '20s',
+                                                            use_cache=False, length='100s'))
+    finally:
+        server.stop()
+    # 4 channels at once (plus a response that may still be finishing)
+    assert 3 < server.max_active <= 5
+    assert sorted(df.columns) == ['ch0', 'ch1', 'ch2', 'ch3']
+    expected = np.arange(START, START + 100*1000000, 10000)
+    assert np.array_equal(df.index.values.astype('datetime64[us]').astype(np.int64), expected)
+    for name in df.columns:
+        assert np.allclose(df[name].values, expected/1.0e6)
+
+
+def test_get_events_shared_timestamps(local_cache, monkeypatch):
+    monkeypatch.setattr(settings, 'ts_event_page_size', 100)
+    # events sharing a timestamp across the page limit, and more than a page at once
+    events = [START + i*1000 for i in range(95)] + [START + 95000]*10 + \
+             [START + 96000 + i*1000 for i in range(10)] + [START + 200000]*250 + [START + 201000]
+    channel = dict(EVENT_CHANNELS[0], start=events[0], end=events[-1], events=events)
+    server = StreamingServer([channel]).start()
+    try:
+        ch = make_timeseries(server).channels[0]
+        assert ch.get_events(use_cache=True).tolist() == events
+        # cached blocks are complete
+        server.requests[:] = []
+        assert ch.get_events(use_cache=True).tolist() == events
+        assert not server.requests
+    finally:
+        server.stop()